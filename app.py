@@ -1,3 +1,4 @@
+import os
 import sys
 import time
 import logging
@@ -8,7 +9,8 @@ from werkzeug.serving import WSGIRequestHandler, _log
 from src.bcz import BCZ, recordInfo, verifyInfo, refreshTempMemberTable, analyseWeekInfo, getWeekOption
 from src.config import Config
 from src.sqlite import SQLite
-from src.xlsx import Xlsx
+from src.export import Export
+from src.refresher import Refresher
 from src.schedule import Schedule
 
 # if '--debug' in sys.argv or (hasattr(sys, 'gettrace') and sys.gettrace() is not None):
@@ -33,9 +35,9 @@ app.json.ensure_ascii = False
 
 config = Config()
 bcz = BCZ(config)
-xlsx = Xlsx(config)
 sqlite = SQLite(config)
-processing = False
+export = Export(config, sqlite)
+refresher = Refresher(config, bcz, sqlite)
 
 if not config.main_token:
     print('未配置授权令牌，请在[config.json]文件中填入正确main_token后重启，程序会在5秒后自动退出')
@@ -64,20 +66,30 @@ def setting():
 
 @app.route('/download', methods=['POST'])
 def download():
-    global processing
-    if processing:
-        return restful(403, '有正在处理的下载，请稍后再试 (ᗜ ˰ ᗜ)"')
-    processing = True
+    '''提交导出任务'''
     try:
-        result = sqlite.queryMemberTable(request.json)
-        xlsx = Xlsx(config)
-        xlsx.write('用户信息', result[0])
-        xlsx.save()
+        job = export.submit(request.json)
     except Exception as e:
-        return restful(500, f'下载数据时发生错误(X_X): {e}')
-    finally:
-        processing = False
-    return send_file(config.output_file)
+        return restful(500, f'提交下载任务时发生错误(X_X): {e}')
+    return restful(200, '', job)
+
+@app.route('/download/<job_id>', methods=['GET'])
+def download_status(job_id=None):
+    '''查询导出任务进度'''
+    job = export.get(job_id)
+    if not job:
+        return restful(404, '下载任务不存在或已过期Σ(っ °Д °;)っ')
+    return restful(200, '', export.getPublicInfo(job))
+
+@app.route('/download/<job_id>/file', methods=['GET'])
+def download_file(job_id=None):
+    '''下载导出任务生成的文件'''
+    job = export.get(job_id)
+    if not job:
+        return restful(404, '下载任务不存在或已过期Σ(っ °Д °;)っ')
+    if job['status'] != 'done':
+        return restful(403, '下载任务尚未完成，请稍后再试 (ᗜ ˰ ᗜ)"')
+    return send_file(job['file'], as_attachment=True, download_name=os.path.basename(config.output_file))
 
 @app.route('/get_data_info', methods=['GET'])
 def get_data_info():
@@ -100,7 +112,7 @@ def observe_group():
         '''获取关注小班列表'''
         group_id = request.args.get('id', '')
         try:
-            group_list = refreshTempMemberTable(bcz, sqlite, group_id, all=False, latest=True)
+            group_list = refreshTempMemberTable(bcz, sqlite, group_id, all=False, latest=not refresher.running, stale=refresher.running)
             for group in group_list:
                 group['auth_token'] = len(group['auth_token']) * '*'
                 if not group_id:
@@ -143,7 +155,7 @@ def query_group_details():
     if not group_id:
         return restful(400, '调用方法异常Σ(っ °Д °;)っ')
     try:
-        group_list = refreshTempMemberTable(bcz, sqlite, group_id)
+        group_list = refreshTempMemberTable(bcz, sqlite, group_id, stale=refresher.running)
         for group in group_list:
             group['auth_token'] = len(group['auth_token']) * '*'
         analyseWeekInfo(group_list, sqlite, week)
@@ -166,8 +178,9 @@ def get_search_option():
 @app.route('/query_member_table', methods=['POST'])
 def query_member_table():
     try:
-        refreshTempMemberTable(bcz, sqlite)
+        group_list = refreshTempMemberTable(bcz, sqlite, stale=refresher.running)
         result = sqlite.queryMemberTable(request.json, header=True, union_temp=True)
+        result['cache_age'] = max([group['cache_age'] or 0 for group in group_list], default=0)
         data = []
         for row in result['data']:
             row = list(row)
@@ -226,7 +239,8 @@ def restful(code: int, msg: str = '', data: dict = {}) -> Response:
 if __name__ == '__main__':
     logging.info('BCZ-Group-Manger 启动中...')
     if config.daily_record:
-        Schedule(config.daily_record, lambda: recordInfo(bcz, sqlite))
+        Schedule(config.daily_record, lambda: recordInfo(bcz, sqlite, config.record_workers, config.record_retry))
     if config.daily_verify:
         Schedule(config.daily_verify, lambda: verifyInfo(bcz, sqlite))
+    refresher.start()
     app.run(config.host, config.port, request_handler=MyRequestHandler)
\ No newline at end of file
@@ -4,10 +4,13 @@ import logging
 import requests
 import asyncio  
 import httpx  
+import threading
 from datetime import timedelta, date, datetime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 
 from src.config import Config
+from src.limiter import RateLimiter, TokenPool
 from src.sqlite import SQLite
 
 logger = logging.getLogger(__name__)
@@ -22,6 +25,85 @@ class BCZ:
         self.group_detail_url = 'https://group.baicizhan.com/group/information'
         self.user_info_url = 'https://social.baicizhan.com/api/deskmate/personal_details'
         self.get_week_rank_url = 'https://group.baicizhan.com/group/get_week_rank'
+        self.timeout = config.request_timeout
+        self.pool_size = config.pool_size
+        self.concurrency = config.concurrency
+        self.connect_retry = 2                      # 连接失败时的重试次数，每次重试都经过限速
+        self.throttle_keywords = ['频繁', '太快', '稍后再试']   # 接口提示请求过于频繁时msg中的关键词
+        self.hash_lock = threading.Lock()
+        self.limiter = RateLimiter(config.token_rate, config.host_rate)
+        self.token_pool = TokenPool(self.main_token)
+        self.refresh_lock = threading.Lock()
+        self.refresh_flights = {}                   # 正在刷新的小班 {小班ID: Future}
+        self.refresh_cache = {}                     # 小班最近一次刷新的结果 {小班ID: 小班信息}
+        self.session = self.createSession()
+
+    def createSession(self) -> requests.Session:
+        '''创建连接池会话，所有请求共用以复用TCP+TLS连接'''
+        session = requests.Session()
+        for host in ['https://group.baicizhan.com', 'https://social.baicizhan.com']:
+            # 每个域名独立的连接池，池大小需不小于并发线程数，否则多余的连接会被丢弃
+            # 不使用urllib3的自动重试，重试由request负责，每次重试都经过限速
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount(host, adapter)
+        return session
+
+    def request(self, url: str, token: str = 'main_token', headers: dict = None) -> requests.Response:
+        '''通过连接池发送GET请求，按令牌与域名限速，仅内部调用'''
+        token = self.resolveToken(url, token)
+        if headers is None:
+            headers = self.getHeaders(token)
+        for attempt in range(self.connect_retry + 1):
+            self.limiter.acquire(url, token)
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                break
+            except requests.ConnectionError as e:
+                # 连接失败时请求未被处理，可以安全重试
+                self.feedback(url, token)
+                if attempt == self.connect_retry:
+                    raise e
+                time.sleep(0.3 * 2 ** attempt)
+            except requests.RequestException as e:
+                self.feedback(url, token)
+                raise e
+        self.feedback(url, token, response)
+        return response
+
+    def resolveToken(self, url: str, token: str) -> str:
+        '''将main_token转换为实际的令牌，仅内部调用'''
+        if token == 'main_token':
+            return self.main_token
+        return token
+
+    def feedback(self, url: str, token: str, response: requests.Response | httpx.Response = None) -> None:
+        '''记录请求结果，response为None表示网络错误，仅内部调用
+
+        限速只在网络错误与被限流时降速，小班不存在、令牌无效等业务错误不代表请求过快
+        令牌池则在令牌无效时暂停使用该令牌，改用主令牌
+        '''
+        self.limiter.feedback(url, token, response is not None and not self.isThrottled(response))
+        self.token_pool.feedback(token, response is not None and self.isValidResponse(response))
+
+    def isValidResponse(self, response: requests.Response | httpx.Response) -> bool:
+        '''请求成功且接口返回code为1'''
+        try:
+            return response.status_code == 200 and response.json().get('code') == 1
+        except ValueError:
+            return False
+
+    def isThrottled(self, response: requests.Response | httpx.Response) -> bool:
+        '''服务端过载或明确提示请求过于频繁'''
+        if response.status_code == 429 or response.status_code >= 500:
+            return True
+        try:
+            data = response.json()
+        except ValueError:
+            return False
+        if not isinstance(data, dict) or data.get('code') == 1:
+            return False
+        msg = str(data.get('msg') or data.get('message') or '')
+        return any(keyword in msg for keyword in self.throttle_keywords)
 
     headers = {
         "default_headers_dict": {
@@ -58,19 +140,21 @@ class BCZ:
             auth_token = self.main_token
 
         current_headers = self.headers['default_headers_dict'].copy()
+        # Cookie需要单独复制，否则多线程请求会互相覆盖同一个字典
+        cookie = current_headers['Cookie'].copy()
 
         if auth_token not in self.hash_rmb:
-            
-            # 使用哈希函数计算字符串的哈希值
-            hash_value = hash(auth_token)
-            # 将哈希值转换为unsigned long long值，然后取反，再转换为16进制字符串
-            hex_string = format((~hash_value) & 0xFFFFFFFFFFFFFFFF, '016X')
-            self.hash_rmb[auth_token] = {'hex_string': hex_string }
-        
-
-        current_headers['Cookie']['device_id'] = f'{self.hash_rmb[auth_token]["hex_string"]}'
-        current_headers['Cookie']['access_token'] = auth_token
-        current_headers['Cookie']['client_time'] = str(int(time.time()))
+            with self.hash_lock:
+                # 使用哈希函数计算字符串的哈希值
+                hash_value = hash(auth_token)
+                # 将哈希值转换为unsigned long long值，然后取反，再转换为16进制字符串
+                hex_string = format((~hash_value) & 0xFFFFFFFFFFFFFFFF, '016X')
+                self.hash_rmb[auth_token] = {'hex_string': hex_string }
+
+        cookie['device_id'] = f'{self.hash_rmb[auth_token]["hex_string"]}'
+        cookie['access_token'] = auth_token
+        cookie['client_time'] = str(int(time.time()))
+        current_headers['Cookie'] = '; '.join(f'{key}={value}' for key, value in cookie.items())
         return current_headers
     
 
@@ -84,6 +168,7 @@ class BCZ:
             'token_valid': token_valid,
             'uid': main_info['uid'],
             'name': main_info['name'],
+            'token_pool': self.token_pool.getInfo(),
         }
 
     def getOwnInfo(self, token: str) -> dict:
@@ -92,8 +177,7 @@ class BCZ:
             'uid': None,
             'name': None,
         }
-        headers = self.getHeaders(token)
-        response = requests.get(self.own_info_url, headers=headers, timeout=5)
+        response = self.request(self.own_info_url, token)
         if response.status_code != 200 or response.json().get('code') != 1:
             logger.warning(f'使用token获取用户信息失败!\n{response.text}')
         user_info = response.json().get('data')
@@ -106,8 +190,7 @@ class BCZ:
         if not user_id:
             return
         url = f'{self.user_info_url}?uniqueId={user_id}'
-        headers = self.getHeaders(self.main_token)
-        response = requests.get(url, headers=headers, timeout=5)
+        response = self.request(url)
         if response.status_code != 200 or response.json().get('code') != 1:
             msg = f'获取我的小班信息失败! 用户不存在或主授权令牌无效'
             logger.error(f'{msg}\n{response.text}')
@@ -120,8 +203,7 @@ class BCZ:
         if not user_id:
             return
         url = f'{self.group_list_url}?uniqueId={user_id}'
-        headers = self.getHeaders(self.main_token)
-        response = requests.get(url, headers=headers, timeout=5)
+        response = self.request(url)
         if response.status_code != 200 or response.json().get('code') != 1:
             msg = f'获取我的小班信息失败! 用户不存在或主授权令牌无效'
             logger.error(f'{msg}\n{response.text}')
@@ -129,7 +211,7 @@ class BCZ:
         group_info = response.json().get('data')
         group_list = group_info.get('list') if group_info else []
         groups = []
-        self.data_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        data_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         for group in group_list:
             group_id = group['id']
             group_name = group['name'] if group['name'] else ''
@@ -152,7 +234,7 @@ class BCZ:
                 'type': group['type'],
                 'avatar': group['avatar'],
                 'avatar_frame': avatar_frame,
-                'data_time': self.data_time,
+                'data_time': data_time,
                 'join_days': group['joinDays'],
             })
         return groups
@@ -161,13 +243,12 @@ class BCZ:
         '''获取【班内主页】信息group/information'''
         
         group = {}
-        self.data_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        data_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         url = f'{self.group_detail_url}?shareKey={share_key}'
-        headers = self.getHeaders(self.main_token)
-        main_response = requests.get(url, headers=headers, timeout=5)
+        main_response = self.request(url)
+        auth_response = None
         if auth_token:
-            headers = self.getHeaders(auth_token)
-            auth_response = requests.get(url, headers=headers, timeout=5)
+            auth_response = self.request(url, auth_token)
         if main_response.status_code != 200 or main_response.json().get('code') != 1:
             msg = f'获取分享码为{share_key}的小班信息失败! 小班不存在或主授权令牌无效'
             logger.warning(f'{msg}\n{main_response.text}')
@@ -177,10 +258,10 @@ class BCZ:
                 'exception': main_response.text,
             }
 
-        return self.parseGroupInfo(main_response, auth_response if auth_response else None, auth_token)
+        return self.parseGroupInfo(main_response, auth_response if auth_response else None, auth_token, data_time)
 
-    def parseGroupInfo(self, main_response: dict, auth_response: dict = None, auth_token: str = '') -> dict | None:
-        '''请调用 getGroupInfo 或 getGroupsInfo，此函数仅内部调用，仅用于信息解析'''
+    def parseGroupInfo(self, main_response: dict, auth_response: dict = None, auth_token: str = '', data_time: str = '') -> dict | None:
+        '''请调用 getGroupInfo 或 getGroupsInfo，此函数仅内部调用，仅用于信息解析，data_time由调用方传入，避免并发获取时互相覆盖'''
         
         main_data = main_response.json().get('data')
         group_info = main_data.get('groupInfo') if main_data else []
@@ -206,7 +287,7 @@ class BCZ:
             'avatar': group_info['avatar'],
             'avatar_frame': avatar_frame,
             'notice': notice,
-            'data_time': self.data_time,
+            'data_time': data_time,
         }
 
         today_date = main_data.get('todayDate') if main_data else ''
@@ -234,7 +315,7 @@ class BCZ:
                 'duration_days': member['durationDays'],
                 'today_study_cheat': '是' if member['todayStudyCheat'] else '否',
                 'today_date': today_date,
-                'data_time': self.data_time,
+                'data_time': data_time,
             })
             if member['leader']:
                 group['leader'] = member['nickname']
@@ -258,75 +339,159 @@ class BCZ:
 
         return group
 
-    async def fetch_url(url, headers: dict):  
+    async def fetchUrl(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str, token: str = 'main_token', headers: dict = None) -> httpx.Response:
         '''异步请求，仅内部调用'''
-        async with httpx.AsyncClient() as client:  
-            client.headers = headers  
-            response = await client.get(url)  
-            response.raise_for_status()  # 如果请求失败则抛出异常  
-            return response  
-    
-    async def asyncGroupsInfo(self, share_key: list, auth_token: str = ''):
-        '''请使用下面的getGroupsInfo函数，仅内部调用''' 
-        
-        urls = []
-        for share_key in share_key:
-            urls.push(f'{self.group_detail_url}?shareKey={share_key}')
-        # 使用 asyncio.gather 来并发地执行所有请求  
-        
-        main_headers = self.getHeaders(self.main_token)
-        auth_headers = self.getHeaders(auth_token)
-        auth_response = await asyncio.gather(*[self.fetch_url(url, main_headers) for url in urls])  
-        main_response = await asyncio.gather(*[self.fetch_url(url, auth_headers) for url in urls])  
-
+        token = self.resolveToken(url, token)
+        if headers is None:
+            headers = self.getHeaders(token)
+        await self.limiter.asyncAcquire(url, token)
+        async with semaphore:
+            try:
+                response = await client.get(url, headers=headers)
+            except httpx.HTTPError as e:
+                self.feedback(url, token)
+                raise e
+        self.feedback(url, token, response)
+        return response
+
+    async def asyncGroupsInfo(self, share_keys: list, auth_tokens: list) -> list:
+        '''请使用下面的getGroupsInfo函数，仅内部调用'''
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            # 公开视角与授权令牌视角的请求同时发出，共用一个客户端连接池，由信号量限制并发数
+            # 公开视角必须使用不在任何关注小班中的主令牌，令牌池中的令牌可能属于被获取的小班
+            tasks = []
+            for share_key, auth_token in zip(share_keys, auth_tokens):
+                url = f'{self.group_detail_url}?shareKey={share_key}'
+                tasks.append(self.fetchUrl(client, semaphore, url))
+                if auth_token:
+                    tasks.append(self.fetchUrl(client, semaphore, url, auth_token))
+            responses = await asyncio.gather(*tasks, return_exceptions=True)
+
+        data_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         group_list = []
-        for i, result in enumerate(auth_response):
-            group_list.push(self.parseGroupInfo(main_response[i], auth_response[i], auth_token))
-
+        responses = iter(responses)
+        for share_key, auth_token in zip(share_keys, auth_tokens):
+            main_response = next(responses)
+            auth_response = next(responses) if auth_token else None
+            if isinstance(auth_response, Exception):
+                logger.warning(f'使用授权令牌获取分享码为{share_key}的小班信息失败: {auth_response}')
+                auth_response, auth_token = None, ''
+            if isinstance(main_response, Exception):
+                msg = f'获取分享码为{share_key}的小班信息失败! {main_response}'
+                logger.warning(msg)
+                group_list.append({
+                    'share_key': share_key,
+                    'exception': msg,
+                })
+            elif main_response.status_code != 200 or main_response.json().get('code') != 1:
+                msg = f'获取分享码为{share_key}的小班信息失败! 小班不存在或主授权令牌无效'
+                logger.warning(f'{msg}\n{main_response.text}')
+                group_list.append({
+                    'share_key': share_key,
+                    'exception': main_response.text,
+                })
+            else:
+                group_list.append(self.parseGroupInfo(main_response, auth_response, auth_token, data_time))
         return group_list
 
-    def getGroupsInfo(self, share_key: list, auth_token: str = '') -> list:
-        '''【多个 班内主页】并发获取''' 
-        return asyncio.run(self.asyncGroupsInfo(self, share_key, auth_token))
-            
-    def getGroupDakaHistory(self, share_key: str) -> dict:
-        '''获取小班成员历史打卡信息'''
-        url = f'{self.get_week_rank_url}?shareKey={share_key}'
-        headers = {'Cookie': f'access_token="{self.main_token}"'}
-        week_response = requests.get(f'{url}&week=1', headers=headers, timeout=5)
-        if week_response.status_code != 200 or week_response.json().get('code') != 1:
-            msg = f'获取分享码为{share_key}的小班成员历史打卡信息失败! 小班不存在或主授权令牌无效'
-            logger.warning(f'{msg}\n{week_response.text}')
-            return {}
-        last_week_response = requests.get(f'{url}&week=2', headers=headers, timeout=5)
-        week_data = week_response.json().get('data')
-        last_week_data = last_week_response.json().get('data')
-        daka_dict = {}
-        for member in week_data.get('list', []):
-            id = member['uniqueId']
-            daka_dict[id] = member['weekDakaDates']
-        for member in last_week_data.get('list', []):
-            id = member['uniqueId']
-            daka_dict.update({
-                id: member['weekDakaDates']
-            })
-        return daka_dict
+    def getGroupsInfo(self, share_keys: list, auth_tokens: list = None) -> list:
+        '''【多个 班内主页】并发获取，返回顺序与share_keys一致'''
+        if not share_keys:
+            return []
+        if auth_tokens is None:
+            auth_tokens = [''] * len(share_keys)
+        return asyncio.run(self.asyncGroupsInfo(share_keys, auth_tokens))
+
+    def getGroupDakaHistory(self, share_key: str, auth_token: str = '') -> dict | None:
+        '''获取小班成员本周与上周的历史打卡信息 {成员ID: {打卡日期}}，两周都获取失败时返回None'''
+        return self.getGroupsDakaHistory([share_key], [auth_token])[0]
+
+    async def asyncGroupsDakaHistory(self, share_keys: list, auth_tokens: list) -> list:
+        '''请使用下面的getGroupsDakaHistory函数，仅内部调用'''
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            # 周榜内容与查看者无关，优先使用小班自己的授权令牌，分担主令牌的请求量
+            tasks = []
+            for share_key, auth_token in zip(share_keys, auth_tokens):
+                token = self.token_pool.choose(auth_token)
+                headers = {'Cookie': f'access_token="{token}"'}
+                url = f'{self.get_week_rank_url}?shareKey={share_key}'
+                tasks.append(self.fetchUrl(client, semaphore, f'{url}&week=1', token, headers))
+                tasks.append(self.fetchUrl(client, semaphore, f'{url}&week=2', token, headers))
+            responses = await asyncio.gather(*tasks, return_exceptions=True)
+
+        history_list = []
+        responses = iter(responses)
+        for share_key in share_keys:
+            daka_dict = {}
+            succeeded = False
+            # 本周与上周的打卡日期合并，两周都有的成员不会被覆盖
+            for week_response in [next(responses), next(responses)]:
+                if isinstance(week_response, Exception):
+                    logger.warning(f'获取分享码为{share_key}的小班成员历史打卡信息失败! {week_response}')
+                    continue
+                if week_response.status_code != 200 or week_response.json().get('code') != 1:
+                    msg = f'获取分享码为{share_key}的小班成员历史打卡信息失败! 小班不存在或授权令牌无效'
+                    logger.warning(f'{msg}\n{week_response.text}')
+                    continue
+                succeeded = True
+                for member in week_response.json().get('data', {}).get('list', []):
+                    daka_dict.setdefault(str(member['uniqueId']), set()).update(member['weekDakaDates'])
+            history_list.append(daka_dict if succeeded else None)
+        return history_list
+
+    def getGroupsDakaHistory(self, share_keys: list, auth_tokens: list = None) -> list:
+        '''【多个 小班本周与上周打卡详情】并发获取，返回顺序与share_keys一致，获取失败的小班为None'''
+        if not share_keys:
+            return []
+        if not auth_tokens:
+            auth_tokens = [''] * len(share_keys)
+        return asyncio.run(self.asyncGroupsDakaHistory(share_keys, auth_tokens))
+
+    def getUserInfoRAW(self, user_id: str, token: str = 'main_token') -> dict:
+        '''【用户校牌】获取指定用户的原始信息，供筛选使用'''
+        response = self.request(f'{self.user_info_url}?uniqueId={user_id}', token)
+        if not self.isValidResponse(response):
+            msg = f'获取用户{user_id}的信息失败! 用户不存在或授权令牌无效'
+            logger.warning(f'{msg}\n{response.text}')
+            raise Exception(msg)
+        return response.json().get('data')
+
+    def getMemberInfoRAW(self, token: str, share_key: str) -> dict:
+        '''【班内主页】获取小班的原始信息，包含groupInfo与members，供筛选使用'''
+        response = self.request(f'{self.group_detail_url}?shareKey={share_key}', token)
+        if not self.isValidResponse(response):
+            msg = f'获取分享码为{share_key}的小班信息失败! 小班不存在或授权令牌无效'
+            logger.warning(f'{msg}\n{response.text}')
+            raise Exception(msg)
+        return response.json().get('data')
+
+    def getRankInfoRAW(self, token: str, share_key: str) -> dict:
+        '''【小班周榜】获取小班本周与上周排行榜的原始列表 {'1': 本周, '2': 上周}，供筛选使用'''
+        if token == 'main_token':
+            token = self.main_token
+        headers = {'Cookie': f'access_token="{token}"'}
+        rank_dict = {}
+        for week in ['1', '2']:
+            response = self.request(f'{self.get_week_rank_url}?shareKey={share_key}&week={week}', token, headers)
+            if not self.isValidResponse(response):
+                msg = f'获取分享码为{share_key}的小班排行榜失败! 小班不存在或授权令牌无效'
+                logger.warning(f'{msg}\n{response.text}')
+                raise Exception(msg)
+            rank_dict[week] = response.json().get('data', {}).get('list', [])
+        return rank_dict
 
     def updateGroupInfo(self, group_list: list[dict], full_info: bool = False) -> list:
         '''【参数传入的班内主页】获取最新信息并刷新小班信息列表'''
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for group in group_list:
-                if not group.get('valid'):
-                    continue
-                future = executor.submit(
-                    lambda argv: self.getGroupInfo(argv[0], argv[1]),
-                    (group['share_key'], group['auth_token'])
-                )
-                futures.append(future)
-
-        for future in futures:
-            result = future.result()
+        valid_list = [group for group in group_list if group.get('valid')]
+        result_list = self.getGroupsInfo(
+            [group['share_key'] for group in valid_list],
+            [group['auth_token'] for group in valid_list],
+        )
+        for result in result_list:
             for group_info in group_list:
                 if group_info['id'] == result.get('id'):
                      group_info.update(result)
@@ -346,57 +511,172 @@ class BCZ:
         user_info['group_dict'] = group_dict
         return user_info
 
-def recordInfo(bcz: BCZ, sqlite: SQLite):
-    '''记录用户信息'''
-    group_info_list = []
-    for group in sqlite.queryObserveGroupInfo():
-        if group['daily_record']:
-            logger.info(f'正在获取小班[{group["name"]}({group["id"]})]的数据')
-            group_info_list.append(bcz.getGroupInfo(group['share_key'], group['auth_token']))
-    sqlite.saveGroupInfo(group_info_list)
-
-def verifyInfo(bcz: BCZ, sqlite: SQLite):
-    '''通过小班成员排行榜补全打卡信息'''
+def recordGroupInfo(bcz: BCZ, sqlite: SQLite, group: dict, retry: int = 2) -> dict:
+    '''获取并立即保存单个小班的数据，失败时指数退避重试，返回本次记录的统计'''
+    start_time = time.time()
+    error = ''
+    for attempt in range(1, retry + 2):
+        try:
+            group_info = bcz.getGroupInfo(group['share_key'], group['auth_token'])
+            if group_info.get('exception'):
+                error = group_info['exception']
+            elif not sqlite.saveGroupInfo([group_info]):
+                error = '保存数据失败'
+            else:
+                return {
+                    'id': group['id'],
+                    'name': group['name'],
+                    'success': True,
+                    'attempt': attempt,
+                    'member_count': len(group_info['members']),
+                    'latency': time.time() - start_time,
+                }
+        except Exception as e:
+            error = e
+        if attempt <= retry:
+            delay = 2 ** (attempt - 1)
+            logger.warning(f'获取小班[{group["name"]}({group["id"]})]的数据失败，{delay}秒后第{attempt}次重试: {error}')
+            time.sleep(delay)
+    logger.error(f'记录小班[{group["name"]}({group["id"]})]的数据失败: {error}')
+    return {
+        'id': group['id'],
+        'name': group['name'],
+        'success': False,
+        'attempt': retry + 1,
+        'member_count': 0,
+        'latency': time.time() - start_time,
+    }
+
+def recordInfo(bcz: BCZ, sqlite: SQLite, workers: int = 4, retry: int = 2) -> list[dict]:
+    '''记录用户信息，各小班并发获取并分别提交，单个小班失败不影响其他小班'''
+    start_time = time.time()
+    group_list = [group for group in sqlite.queryObserveGroupInfo() if group['daily_record']]
+    logger.info(f'开始记录{len(group_list)}个小班的数据')
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+        futures = [executor.submit(recordGroupInfo, bcz, sqlite, group, retry) for group in group_list]
+        summary = [future.result() for future in as_completed(futures)]
+    success_count = len([item for item in summary if item['success']])
+    logger.info(
+        f'记录完成，共{len(summary)}个小班，成功{success_count}个，'
+        f'失败{len(summary) - success_count}个，耗时{time.time() - start_time:.2f}秒'
+    )
+    for item in sorted(summary, key=lambda x: x['latency'], reverse=True):
+        logger.info(
+            f'小班[{item["name"]}({item["id"]})] {"成功" if item["success"] else "失败"}，'
+            f'成员{item["member_count"]}人，尝试{item["attempt"]}次，耗时{item["latency"]:.2f}秒'
+        )
+    return summary
+
+def verifyInfo(bcz: BCZ, sqlite: SQLite) -> dict:
+    '''通过小班成员排行榜补全打卡信息，返回每个小班补全的记录数，排行榜获取失败的小班为None'''
+    valid_list = sqlite.queryObserveGroupInfo()
+    bcz.token_pool.sync([group['auth_token'] for group in valid_list])
+    group_list = [group for group in valid_list if group['daily_record']]
+    logger.info(f'正在获取{len(group_list)}个小班的历史打卡数据')
+    history_list = bcz.getGroupsDakaHistory(
+        [group['share_key'] for group in group_list],
+        [group['auth_token'] for group in group_list],
+    )
+    sdate = (datetime.now() - timedelta(days=7*2)).strftime('%Y-%m-%d')
     makeup_list = []
-    for group in sqlite.queryObserveGroupInfo():
-        if group['daily_record']:
-            logger.info(f'正在获取小班[{group["name"]}({group["id"]})]的历史打卡数据')
-            daka_dict = bcz.getGroupDakaHistory(group['share_key'])
-            sdate = (datetime.now() - timedelta(days=7*2)).strftime('%Y-%m-%d')
-            member_list = sqlite.queryMemberTable(
-                {
+    repaired_dict = {}
+    for group, daka_dict in zip(group_list, history_list):
+        if daka_dict is None:
+            repaired_dict[group['id']] = None
+            logger.error(f'小班[{group["name"]}({group["id"]})]排行榜获取失败，未能补全打卡记录')
+            continue
+        # 以(成员ID, 日期)为键，排行榜中有打卡记录而数据库中缺卡的即为需要补全的记录
+        daka_set = {(id, daka_date) for id, dates in daka_dict.items() for daka_date in dates}
+        repaired = 0
+        for user_id, today_date in sqlite.queryAbsenceMember(group['id'], sdate):
+            if (str(user_id), today_date) in daka_set:
+                repaired += 1
+                makeup_list.append({
+                    'id': user_id,
                     'group_id': group['id'],
-                    'sdate': sdate,
-                    'page_count': 'unlimited',
-                    
-                },
-                header = False,
-            )['data']
-            absence_dict = {line[0]:line[4] for line in member_list if line[3] == ''}
-            if not absence_dict:
-                continue
-            for id in daka_dict:
-                for daka_date in daka_dict[id]:
-                    if id in absence_dict and daka_date in absence_dict[id]:
-                        makeup_list.append({
-                            'id': id,
-                            'group_id': group['id'],
-                            'today_date': daka_date,
-                            'completed_time': '晚于记录时间',
-                            'today_word_count': '?',
-                        })
-    sqlite.updateMemberInfo(makeup_list)
-
-def refreshTempMemberTable(bcz: BCZ, sqlite: SQLite, group_id: str = '', all: bool = True, latest: bool = False) -> list[dict]:
-    '''刷新成员临时表数据并返回小班数据列表'''
-    data_time = sqlite.queryTempMemberCacheTime()
+                    'today_date': today_date,
+                    'completed_time': '晚于记录时间',
+                    'today_word_count': '?',
+                })
+        repaired_dict[group['id']] = repaired
+        logger.info(f'小班[{group["name"]}({group["id"]})]补全了{repaired}条打卡记录')
+    # 保存失败时仍返回各小班的排行榜结果，失败单独记录，下次补全时会重新检查这些缺卡记录
+    if makeup_list and not sqlite.updateMemberInfo(makeup_list):
+        logger.error(f'保存{len(makeup_list)}条补全的打卡记录失败，各小班的补全数量未写入数据库')
+    return repaired_dict
+
+def refreshTempMemberTable(
+        bcz: BCZ,
+        sqlite: SQLite,
+        group_id: str = '',
+        all: bool = True,
+        latest: bool = False,
+        max_age: int = None,
+        stale: bool = False,
+    ) -> list[dict]:
+    '''刷新成员临时表数据并返回小班数据列表，每个小班附带数据距今的秒数cache_age
+
+    每个小班单独判断缓存是否超过max_age秒(默认为cache_second)，同一小班同时只有一个刷新，其余调用等待并共用其结果
+    stale为真时只要有刷新过的结果就直接返回，由后台刷新保持数据新鲜，从未刷新过的小班仍同步刷新
+    '''
+    if max_age is None:
+        max_age = sqlite.cache_second
     group_list = sqlite.queryObserveGroupInfo(group_id, all=all)
-    if latest or (int(time.time()) - data_time > sqlite.cache_second or group_id):
-        group_list = bcz.updateGroupInfo(group_list)
-        sqlite.updateObserveGroupInfo(group_list)
-        sqlite.deleteTempMemberTable(group_id)
-        sqlite.saveGroupInfo(group_list, temp=True)
-    return group_list
+    now = int(time.time())
+    result_dict = {}
+    wait_dict = {}
+    refresh_list = []
+    with bcz.refresh_lock:
+        for group in group_list:
+            if group['id'] in bcz.refresh_cache and (
+                stale
+                or not latest and now - sqlite.queryTempMemberCacheTime(group['id']) <= max_age
+            ):
+                result_dict[group['id']] = bcz.refresh_cache[group['id']]
+            elif group['id'] in bcz.refresh_flights:
+                wait_dict[group['id']] = bcz.refresh_flights[group['id']]
+            else:
+                bcz.refresh_flights[group['id']] = Future()
+                refresh_list.append(group)
+
+    if refresh_list:
+        error = None
+        try:
+            bcz.updateGroupInfo(refresh_list)
+            sqlite.updateObserveGroupInfo(refresh_list, changed_only=True, local=False)
+            sqlite.saveTempGroupInfo(refresh_list)
+        except BaseException as e:
+            # 包括KeyboardInterrupt等非Exception异常，等待中的调用统一收到普通异常
+            error = e if isinstance(e, Exception) else Exception(f'刷新被中断: {e!r}')
+            raise
+        finally:
+            # 无论成功与否都必须完成并移除Future，否则等待该小班的调用会永远挂起
+            with bcz.refresh_lock:
+                for group in refresh_list:
+                    future = bcz.refresh_flights.pop(group['id'], None)
+                    if error is not None:
+                        if future:
+                            future.set_exception(error)
+                        continue
+                    if not group.get('exception'):
+                        bcz.refresh_cache[group['id']] = group
+                    if future:
+                        future.set_result(group)
+                    result_dict[group['id']] = group
+
+    for id, future in wait_dict.items():
+        result_dict[id] = future.result()
+
+    # 刷新结果被多个调用共用，返回副本，仅存在于本地的关注设置以数据库为准
+    group_result = []
+    for group in group_list:
+        result = result_dict[group['id']].copy()
+        result.update({key: group[key] for key in ['daily_record', 'late_daka_time', 'auth_token', 'valid']})
+        result['members'] = [member.copy() for member in result.get('members', [])]
+        data_time = sqlite.queryTempMemberCacheTime(group['id'])
+        result['cache_age'] = int(time.time()) - data_time if data_time else None
+        group_result.append(result)
+    return group_result
 
 def analyseWeekInfo(group_list: list[dict], sqlite: SQLite, week_date: str) -> list[dict]:
     '''分析打卡数据并返回'''
@@ -421,83 +701,46 @@ def analyseWeekInfo(group_list: list[dict], sqlite: SQLite, week_date: str) -> l
         group['total_times'] = 0
         group['late_count'] = 0
         group['absence_count'] = 0
-        week_data = sqlite.queryMemberTable(
-            {
-                'group_id': group['id'],
-                'sdate': sdate,
-                'edate': edate,
-                'page_count': 'unlimited',
-                
-            },
-            header = False,
-        )
-
+        # 迟到与缺卡在数据库中按成员汇总，只取回汇总结果与每日打卡时间
         today_date = group['members'][0]['today_date']
-        member_list = [member['id'] for member in group['members']]
-        for line in week_data['data']:
-            if line[0] not in member_list:
-                member_list.append(line[0])
-                group['members'].append(dict(zip(
-                    [
-                        'id',
-                        'nickname',
-                        'group_nickname',
-                        'completed_time',
-                        'today_date',
-                        'today_word_count',
-                        'today_study_cheat',
-                        'completed_times',
-                        'duration_days',
-                        'book_name',
-                        'group_id',
-                        'group_name',
-                        'avatar',
-                        'data_time',
-                    ],
-                    [
-                        line[0],
-                        line[1],
-                        line[2],
-                        '',
-                        today_date,
-                        0,
-                        False,
-                        line[7],
-                        line[8],
-                        line[9],
-                        line[10],
-                        line[11],
-                        line[12],
-                        ''
-                    ]
-                )))
+        week_data = sqlite.queryWeekSummary(group['id'], sdate, edate, today_date, group['late_daka_time'])
+        summary_dict = {summary['id']: summary for summary in week_data['members']}
+
+        member_ids = {member['id'] for member in group['members']}
+        for summary in week_data['members']:
+            if summary['id'] in member_ids:
+                continue
+            member_ids.add(summary['id'])
+            group['members'].append({
+                'id': summary['id'],
+                'nickname': summary['nickname'],
+                'group_nickname': summary['group_nickname'],
+                'completed_time': '',
+                'today_date': today_date,
+                'today_word_count': 0,
+                'today_study_cheat': False,
+                'completed_times': summary['completed_times'],
+                'duration_days': summary['duration_days'],
+                'book_name': summary['book_name'],
+                'group_id': summary['group_id'],
+                'group_name': summary['group_name'],
+                'avatar': summary['avatar'],
+                'data_time': '',
+            })
 
         for member in group['members']:
-            daka_time_dict = {}
-            late = 0
-            absence = 0
             if is_this_week and member['completed_time']:
                 group['total_times'] += 1
-            for line in week_data['data']:
-                if line[0] == member['id']:
-                    if line[4] in daka_time_dict or line[4] == member['today_date']:
-                        continue
-                    daka_time_dict[line[4]] = {
-                        'time': line[3],
-                        'count': line[5],
-                    }
-                    if line[3] == '':
-                        absence += 1
-                    else:
-                        group['total_times'] += 1
-                    if group['late_daka_time'] and line[3] > group['late_daka_time']:
-                        late += 1
+            summary = summary_dict.get(member['id'], {})
+            late = summary.get('late', 0)
+            absence = summary.get('absence', 0)
+            group['total_times'] += summary.get('times', 0)
             if late:
                 group['late_count'] += 1
             if absence:
                 group['absence_count'] += 1
             member.update({
-                'daka': daka_time_dict,
+                'daka': week_data['daka'].get(member['id'], {}),
                 'late': late,
                 'absence': absence,
             })
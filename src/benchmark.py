@@ -0,0 +1,228 @@
+import os
+import copy
+import time
+import random
+import logging
+import tempfile
+from types import SimpleNamespace
+from datetime import timedelta, date, datetime
+
+from src.bcz import analyseWeekInfo
+from src.sqlite import SQLite
+
+logger = logging.getLogger(__name__)
+
+def createDatabase(rows: list) -> SQLite:
+    '''在临时目录中创建数据库并写入测试记录'''
+    config = SimpleNamespace(database_path=os.path.join(tempfile.mkdtemp(), 'benchmark.db'), cache_second=60)
+    sqlite = SQLite(config)
+    keys = [
+        'id',
+        'nickname',
+        'group_nickname',
+        'completed_time',
+        'today_date',
+        'today_word_count',
+        'today_study_cheat',
+        'completed_times',
+        'duration_days',
+        'book_name',
+        'group_id',
+        'group_name',
+        'avatar',
+        'data_time',
+    ]
+    sqlite.saveMemberInfo([dict(zip(keys, row)) for row in rows])
+    return sqlite
+
+def buildGroup(member_count: int = 500, leave_count: int = 20, week_date: str = '') -> tuple[dict, list]:
+    '''生成一个测试小班及其一周的打卡记录，其中部分成员已在周内退出'''
+    random.seed(0)
+    if week_date:
+        year, week = map(int, week_date.split('-W'))
+        start_of_week = date.fromisocalendar(year, week, 1)
+    else:
+        start_of_week = date.today() - timedelta(days=date.today().weekday())
+    days = [(start_of_week + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+    today_date = days[-1]
+    members = []
+    rows = []
+    for i in range(member_count + leave_count):
+        user_id = 10000 + i
+        present = i < member_count
+        for day in days if present else days[:random.randint(1, 6)]:
+            completed_time = '' if random.random() < 0.1 else f'{random.randint(6, 23):02d}:{random.randint(0, 59):02d}:00'
+            rows.append((
+                user_id, f'用户{user_id}', '', completed_time, day, random.randint(0, 300), '否',
+                100, 200, '四级词汇', 1, '测试小班', '', f'{day} 23:59:00',
+            ))
+        if present:
+            members.append({
+                'id': user_id,
+                'nickname': f'用户{user_id}',
+                'group_nickname': '',
+                'completed_time': '',
+                'today_date': today_date,
+                'today_word_count': 0,
+                'today_study_cheat': '否',
+                'completed_times': 100,
+                'duration_days': 200,
+                'book_name': '四级词汇',
+                'group_id': 1,
+                'group_name': '测试小班',
+                'avatar': '',
+                'data_time': f'{today_date} 23:59:00',
+            })
+    rows.sort(key=lambda x: (x[13], x[0]), reverse=True)
+    group = {'id': 1, 'name': '测试小班', 'late_daka_time': '22:00', 'members': members}
+    return group, rows
+
+def benchmark(func, group: dict, sqlite: SQLite, week_date: str, repeat: int) -> tuple[float, list]:
+    '''多次运行并返回最短耗时与最后一次的结果'''
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        group_list = [copy.deepcopy(group)]
+        start_time = time.perf_counter()
+        result = func(group_list, sqlite, week_date)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+def legacyAnalyseWeekInfo(group_list: list[dict], sqlite: SQLite, week_date: str) -> list[dict]:
+    '''旧版打卡数据分析，取回整周的记录后每个成员都遍历一次，仅用于对比'''
+    if week_date:
+        year, week = map(int, week_date.split('-W'))
+    else:
+        now = datetime.now()
+        year, week = now.year, now.isocalendar()[1]
+    start_of_year = date(year, 1, 1)
+    start_of_week = start_of_year + timedelta(days=(week - 1) * 7 - start_of_year.weekday())
+    sdate = start_of_week.strftime('%Y-%m-%d')
+    end_of_week = start_of_week + timedelta(days=6)
+    edate = end_of_week.strftime('%Y-%m-%d')
+    is_this_week = False
+    if start_of_week <= date.today() <= end_of_week:
+        is_this_week = True
+    for group in group_list:
+        if not group.get('members'):
+            continue
+
+        group['week'] = week_date
+        group['total_times'] = 0
+        group['late_count'] = 0
+        group['absence_count'] = 0
+        week_data = sqlite.queryMemberTable(
+            {
+                'group_id': group['id'],
+                'sdate': sdate,
+                'edate': edate,
+                'page_count': 'unlimited',
+                
+            },
+            header = False,
+        )
+
+        today_date = group['members'][0]['today_date']
+        member_list = [member['id'] for member in group['members']]
+        for line in week_data['data']:
+            if line[0] not in member_list:
+                member_list.append(line[0])
+                group['members'].append(dict(zip(
+                    [
+                        'id',
+                        'nickname',
+                        'group_nickname',
+                        'completed_time',
+                        'today_date',
+                        'today_word_count',
+                        'today_study_cheat',
+                        'completed_times',
+                        'duration_days',
+                        'book_name',
+                        'group_id',
+                        'group_name',
+                        'avatar',
+                        'data_time',
+                    ],
+                    [
+                        line[0],
+                        line[1],
+                        line[2],
+                        '',
+                        today_date,
+                        0,
+                        False,
+                        line[7],
+                        line[8],
+                        line[9],
+                        line[10],
+                        line[11],
+                        line[12],
+                        ''
+                    ]
+                )))
+
+        for member in group['members']:
+            daka_time_dict = {}
+            late = 0
+            absence = 0
+            if is_this_week and member['completed_time']:
+                group['total_times'] += 1
+            for line in week_data['data']:
+                if line[0] == member['id']:
+                    if line[4] in daka_time_dict or line[4] == member['today_date']:
+                        continue
+                    daka_time_dict[line[4]] = {
+                        'time': line[3],
+                        'count': line[5],
+                    }
+                    if line[3] == '':
+                        absence += 1
+                    else:
+                        group['total_times'] += 1
+                    if group['late_daka_time'] and line[3] > group['late_daka_time']:
+                        late += 1
+            if late:
+                group['late_count'] += 1
+            if absence:
+                group['absence_count'] += 1
+            member.update({
+                'daka': daka_time_dict,
+                'late': late,
+                'absence': absence,
+            })
+
+        # 删除星期天不在小班的成员贡献的打卡天数
+        for member in group['members']:
+            if member['data_time'] == '' and edate not in member['daka']:
+                for daka_date in member['daka']:
+                    daka = member['daka'][daka_date]
+                    if daka['time']:
+                        group['total_times'] -= 1
+                    if group['late_daka_time'] and daka['time'] > group['late_daka_time']:
+                        group['late_count'] -= 1
+
+
+        # 对成员进行排序
+        list.sort(
+            group['members'],
+            key = lambda x: [
+                1 if x['today_study_cheat'] == '是' else 0,
+                x['absence'],
+                x['late'],
+            ],
+            reverse=True
+        )
+    return group_list
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    now = datetime.now()
+    week_date = f'{now.year}-W{now.isocalendar()[1]:02d}'
+    group, rows = buildGroup(week_date=week_date)
+    sqlite = createDatabase(rows)
+    legacy_time, legacy_result = benchmark(legacyAnalyseWeekInfo, group, sqlite, week_date, 3)
+    new_time, new_result = benchmark(analyseWeekInfo, group, sqlite, week_date, 3)
+    logger.info(f'成员{len(group["members"])}人，记录{len(rows)}条')
+    logger.info(f'旧版耗时{legacy_time * 1000:.1f}毫秒，新版耗时{new_time * 1000:.1f}毫秒，提升{legacy_time / new_time:.1f}倍')
+    logger.info(f'结果一致: {legacy_result == new_result}')
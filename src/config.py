@@ -19,6 +19,15 @@ class Config:
             'daily_record': '59 23 * * *',
             'daily_verify': '00 04 * * *',
             'cache_second': 60,
+            'request_timeout': 5,
+            'pool_size': 10,
+            'concurrency': 10,
+            'record_workers': 4,
+            'record_retry': 2,
+            'export_workers': 2,
+            'refresh_second': 30,
+            'token_rate': 5,
+            'host_rate': 20,
         }
         self.initConfig()
         self.raw = self.read()
@@ -30,6 +39,15 @@ class Config:
         self.daily_record = self.raw.get('daily_record', '')
         self.daily_verify = self.raw.get('daily_verify', '')
         self.cache_second = self.raw.get('cache_second', '')
+        self.request_timeout = self.raw.get('request_timeout', '')
+        self.pool_size = self.raw.get('pool_size', '')
+        self.concurrency = self.raw.get('concurrency', '')
+        self.record_workers = self.raw.get('record_workers', '')
+        self.record_retry = self.raw.get('record_retry', '')
+        self.export_workers = self.raw.get('export_workers', '')
+        self.refresh_second = self.raw.get('refresh_second', '')
+        self.token_rate = self.raw.get('token_rate', '')
+        self.host_rate = self.raw.get('host_rate', '')
         self.verify()
 
     def initConfig(self):
@@ -108,6 +126,51 @@ class Config:
             value = self.default_config_dict[key]
             self.save(key, value)
             self.cache_second = value
+        if self.request_timeout == '':
+            key = 'request_timeout'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.request_timeout = value
+        if self.pool_size == '':
+            key = 'pool_size'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.pool_size = value
+        if self.concurrency == '':
+            key = 'concurrency'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.concurrency = value
+        if self.record_workers == '':
+            key = 'record_workers'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.record_workers = value
+        if self.record_retry == '':
+            key = 'record_retry'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.record_retry = value
+        if self.export_workers == '':
+            key = 'export_workers'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.export_workers = value
+        if self.refresh_second == '':
+            key = 'refresh_second'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.refresh_second = value
+        if self.token_rate == '':
+            key = 'token_rate'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.token_rate = value
+        if self.host_rate == '':
+            key = 'host_rate'
+            value = self.default_config_dict[key]
+            self.save(key, value)
+            self.host_rate = value
 
     def getInfo(self) -> dict:
         '''获取配置文件相关状态信息'''
@@ -0,0 +1,132 @@
+import os
+import glob
+import time
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import Config
+from src.sqlite import SQLite
+from src.xlsx import Xlsx
+
+logger = logging.getLogger(__name__)
+
+class Export:
+    def __init__(self, config: Config, sqlite: SQLite) -> None:
+        '''导出任务类，每个任务在线程池中生成独立的表格文件'''
+        self.config = config
+        self.sqlite = sqlite
+        self.reuse_second = config.cache_second     # 相同查询条件在此时间内复用已生成的文件
+        self.keep_second = 3600                     # 已完成任务及其文件的保留时间
+        self.output_dir = os.path.abspath(os.path.dirname(config.output_file) or '.')
+        self.output_name, self.output_ext = os.path.splitext(os.path.basename(config.output_file))
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(int(config.export_workers), 1), thread_name_prefix='Export')
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.removeStaleFiles()
+
+    def submit(self, payload: dict) -> dict:
+        '''提交导出任务，相同条件的任务未失败且未过期时直接返回该任务'''
+        key = hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        self.cleanup()
+        now = time.time()
+        with self.lock:
+            for job in self.jobs.values():
+                if job['key'] != key or job['status'] == 'failed':
+                    continue
+                if not job['finished_time'] or now - job['finished_time'] < self.reuse_second:
+                    logger.info(f'导出任务[{job["id"]}]条件相同，复用该任务')
+                    return self.getPublicInfo(job)
+            job_id = uuid.uuid4().hex
+            job = {
+                'id': job_id,
+                'key': key,
+                'status': 'pending',
+                'progress': 0,
+                'total': 0,
+                'msg': '',
+                'file': os.path.join(self.output_dir, f'{self.output_name}_{job_id}{self.output_ext}'),
+                'created_time': now,
+                'finished_time': 0,
+            }
+            self.jobs[job_id] = job
+        self.executor.submit(self.run, job_id, payload)
+        return self.getPublicInfo(job)
+
+    def run(self, job_id: str, payload: dict) -> None:
+        '''执行导出任务，仅内部调用'''
+        job = self.jobs[job_id]
+        start_time = time.time()
+        try:
+            total = self.sqlite.countMemberTable(payload)
+            self.update(job_id, status='running', total=total)
+            count = Xlsx(self.config).writeStream(
+                '用户信息',
+                self.sqlite.iterMemberTable(payload),
+                job['file'],
+                progress=lambda count: self.update(job_id, progress=count),
+            )
+            self.update(job_id, status='done', progress=count, finished_time=time.time())
+            logger.info(f'导出任务[{job_id}]完成，共{count}条数据，耗时{time.time() - start_time:.2f}秒')
+        except Exception as e:
+            self.update(job_id, status='failed', msg=str(e), finished_time=time.time())
+            logger.error(f'导出任务[{job_id}]失败: {e}')
+
+    def update(self, job_id: str, **kwargs) -> None:
+        '''更新任务状态'''
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(kwargs)
+
+    def get(self, job_id: str) -> dict | None:
+        '''获取任务信息，不存在时返回None'''
+        self.cleanup()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.copy() if job else None
+
+    def getPublicInfo(self, job: dict) -> dict:
+        '''返回可以提供给前端的任务信息'''
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'progress': job['progress'],
+            'total': job['total'],
+            'msg': job['msg'],
+        }
+
+    def cleanup(self) -> None:
+        '''清除过期任务及其文件'''
+        now = time.time()
+        with self.lock:
+            expired = [
+                job for job in self.jobs.values()
+                if job['finished_time'] and now - job['finished_time'] > self.keep_second
+            ]
+            for job in expired:
+                del self.jobs[job['id']]
+        for job in expired:
+            try:
+                if os.path.exists(job['file']):
+                    os.remove(job['file'])
+            except OSError as e:
+                logger.warning(f'删除导出文件{job["file"]}失败: {e}')
+
+    def removeStaleFiles(self) -> None:
+        '''清除上次运行遗留的过期导出文件，此时内存中没有对应的任务记录'''
+        now = time.time()
+        pattern = os.path.join(glob.escape(self.output_dir), f'{glob.escape(self.output_name)}_*{glob.escape(self.output_ext)}')
+        count = 0
+        for file in glob.glob(pattern):
+            try:
+                if now - os.path.getmtime(file) > self.keep_second:
+                    os.remove(file)
+                    count += 1
+            except OSError as e:
+                logger.warning(f'删除导出文件{file}失败: {e}')
+        if count:
+            logger.info(f'已清除{count}个遗留的过期导出文件')
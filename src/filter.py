@@ -1,498 +1,504 @@
 # 4.19计划：完成已经添加的用户(unique_id和accesstoken)、已经添加的班级的同步功能（和bcz.py之间）
 
-# from config import Config
-import threading
-import logging
+import math
 import time
-from config import Strategy
-from bcz import BCZ
+import queue
+import logging
+import operator
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from src.bcz import BCZ
+from src.sqlite import SQLite
+
+logger = logging.getLogger(__name__)
 
 
 class FilterAgent:
     # 这个功能跟BCZ类功能类似，BCZ类就用来现有的每日获取，而FilterAgent类则用来筛选
     def __init__(self, strategy: dict, shareKey: str, strategy_index: str) -> None:
         self.strategy = strategy
+
+
+class MemberContext:
+    def __init__(self, filter: 'Filter', member_dict: dict, unauthorized_token: str) -> None:
+        '''单个成员一次验证的上下文，个人主页与其他小班信息在第一次用到时才读取缓存或请求，同一次验证内共用'''
+        self.filter = filter
+        self.member_dict = member_dict
+        self.unauthorized_token = unauthorized_token
+        self.refer_dict = {}                        # 储存筛选参考数据，每个子条目重新开始
+        self.cache = None                           # 数据库中的筛选缓存 {缓存项: (内容, 获取时间戳)}
+        self.personal_dict = None                   # 本次验证中请求到的个人主页
+        self.their_classes = None
+
+    def getCache(self) -> dict:
+        '''该成员的筛选缓存'''
+        if self.cache is None:
+            self.cache = self.filter.sqlite.queryFilterCache(self.member_dict["uniqueId"])
+        return self.cache
+
+    def getProfile(self, field: str):
+        '''用户个人主页中的字段，缓存未超过该字段的有效期时不请求'''
+        if self.personal_dict is None:
+            cached = self.getCache().get('profile')
+            if cached and time.time() - cached[1] < self.filter.PROFILE_TTL.get(field, 0):
+                return cached[0][field]
+            self.personal_dict = self.filter.checkUserProfile(self.member_dict, self.unauthorized_token)
+        return self.personal_dict[field]
+
+    def getTheirClasses(self) -> dict:
+        '''用户在其他小班的打卡情况'''
+        if self.their_classes is None:
+            self.their_classes = self.filter.checkUserGroups(self)
+        return self.their_classes
+
+
 class Filter:
-    def __init__(self, strategy: dict, shareKey: str, strategy_index: str) -> None:
+    # 要求的代价等级，编译后每个子条目内按代价从低到高判断，需要联网的要求放在最后
+    COST_MEMBER = 0                                 # 只用小班主页中的成员信息
+    COST_RANK = 1                                   # 使用本轮已获取的周榜
+    COST_PROFILE = 2                                # 需要请求用户个人主页
+    COST_GROUPS = 3                                 # 需要请求用户加入的其他小班
+
+    MIN_POLL_INTERVAL = 3                           # 两次轮询之间的最短间隔秒数，保护措施，防止触发反爬
+
+    # 筛选缓存的有效期(秒)，个人主页按字段分别判断，未列出的字段每次都重新请求
+    PROFILE_TTL = {
+        'name': 86400,
+        'deskmateDays': 86400,
+        'tag': 86400,
+        'list': 3600,
+        'userPrivacy': 3600,
+    }
+    CLASS_TTL = 3600                                # 用户在其他小班的打卡情况
+    # 依赖远程数据的要求，验证结果超过对应有效期后需要重新验证，其余要求的输入都包含在成员签名中
+    REQUIREMENT_TTL = {
+        'liked': 0,
+        'deskmate_min': PROFILE_TTL['deskmateDays'],
+        'dependability': PROFILE_TTL['tag'],
+        'group_nickname': PROFILE_TTL['name'],
+        'daka_history': min(PROFILE_TTL['list'], PROFILE_TTL['userPrivacy'], CLASS_TTL),
+    }
+    # 成员签名使用的字段，这些字段变化时重新验证
+    MEMBER_FIELDS = ['completedTime', 'todayStudyCheat', 'durationDays', 'completedTimes', 'nickname']
+
+    def __init__(self, bcz: BCZ, sqlite: SQLite, strategy: dict, shareKey: str, strategy_index: str) -> None:
         # 每个filter对应一个班级，但是strategy因为要前端更新，所以由外部传入
+        self.bcz = bcz
+        self.sqlite = sqlite
         self.strategy = strategy
         self.shareKey = shareKey
         self.strategy_index = strategy_index
+        self.compiled = []                          # 编译后的策略子条目 [{'name', 'strat', 'delay', 'predicates'}]
+        self.strategy_version = 0                   # 每次应用策略时加一，旧策略下仍在进行的验证不会写入结果
+        self.status = {}                            # 验证结果 {uniqueId: 处理结果}，只留在内存中
+        self.my_group_dict = {}                     # 小组成员信息
+        self.my_rank_dict = {}                      # 排名榜 {'1': 本周, '2': 上周}
+        self.rank_index = {'1': {}, '2': {}}        # 由排名榜预先计算的漏卡天数 {'1': {uniqueId: 本周漏卡}, '2': {uniqueId: 上周漏卡}}
+        self.prev_my_group_dict = {}                # 上一次查询的小组成员信息
+        self.verdicts = {}                          # 已验证成员 {uniqueId: (成员签名, 验证时间)}
+        self.verdict_ttl = math.inf                 # 验证结果的有效期，由策略使用的要求决定
+        self.rlock = threading.RLock()
 
         self.activate = False
-        
+
     def getState(self) -> bool:
         return self.activate
-    
-    def applyStrategy(self, strategy_index: str) -> None:
-        # 设置策略
-        self.strategy_index = strategy_index
 
+    def applyStrategy(self, strategy_index: str) -> None:
+        # 设置策略，保存策略时也调用此函数重新编译
+        with self.rlock:
+            self.strategy_index = strategy_index
+            self.compiled = self.compileStrategy(self.strategy.get(strategy_index, {}))
+            self.verdict_ttl = min((
+                self.REQUIREMENT_TTL.get(requirement, math.inf)
+                for sub in self.compiled
+                for requirement in sub['strat'].get('requirement', {})
+            ), default=math.inf)
+            self.verdicts = {} # 策略变化后全部重新验证
+            self.status = {} # 旧策略的处理结果(包括已通过)不再有效
+            self.strategy_version += 1
 
     def stop(self) -> None:
         # 停止筛选，不再分开monitor和activate功能
         if not hasattr(self, "tids"):
             return # 筛选线程没有运行
-        self.rlock.acquire()
-        self.activate = False
-        self.rlock.release()
+        with self.rlock:
+            self.activate = False
         self.tids.join()
         del self.tids
 
-    def 
-    def __checkUserProfile(self, refer_dict:dict, member_dict: dict, strata_name: str, unauthorized_token: str) -> None:
+    def compileStrategy(self, strat: dict) -> list[dict]:
+        '''将策略编译为子条目列表，子条目保持原有顺序，每个子条目内的要求按代价从低到高编译为判断函数'''
+        compiled = []
+        for sub_strata_name, sub_strat in strat.items():
+            if not sub_strata_name.startswith('*'): # 以*开头的才是子条目
+                continue
+            predicate_list = []
+            for requirement, content in sub_strat.get("requirement", {}).items():
+                predicate = self.compileRequirement(requirement, content)
+                if predicate is None:
+                    logger.warning(f'策略子条目{sub_strata_name}中的要求{requirement}无法识别，已忽略')
+                    continue
+                predicate_list.append(predicate)
+            predicate_list.sort(key=lambda x: x[0])
+            compiled.append({
+                'name': sub_strata_name,
+                'strat': sub_strat,
+                'delay': sub_strat.get("delay", 0), # 不写delay 默认立即执行
+                'predicates': [predicate for _, predicate in predicate_list],
+            })
+        return compiled
+
+    def compileRequirement(self, requirement: str, content) -> tuple[int, callable] | None:
+        '''将单个要求编译为(代价, 判断函数)，判断函数接收MemberContext，满足要求时返回True'''
+        def bound(cost: int, refer_key: str, value: callable, compare: callable) -> tuple[int, callable]:
+            '''数值上下限类的要求'''
+            def predicate(ctx: MemberContext) -> bool:
+                number = value(ctx)
+                if number is None: # 周榜中找不到该成员时不作要求
+                    return True
+                ctx.refer_dict[refer_key] = number
+                return compare(number, content)
+            return cost, predicate
+
+        if requirement == "daka_today":
+            if content:
+                def predicate(ctx: MemberContext) -> bool:
+                    ctx.refer_dict["completedTime"] = ctx.member_dict["completedTime"]
+                    return ctx.member_dict["completedTime"] != 0
+            else:
+                def predicate(ctx: MemberContext) -> bool:
+                    ctx.refer_dict["completedTime"] = ctx.member_dict["completedTime"]
+                    return ctx.member_dict["completedTime"] == 0
+            return self.COST_MEMBER, predicate
+        if requirement in ["is_cheat", "is_not_cheat"]:
+            expected = requirement == "is_cheat"
+            def predicate(ctx: MemberContext) -> bool:
+                ctx.refer_dict["is_cheat"] = bool(ctx.member_dict["todayStudyCheat"])
+                return bool(ctx.member_dict["todayStudyCheat"]) == expected
+            return self.COST_MEMBER, predicate
+
+        compare = operator.le if requirement.endswith("_max") else operator.ge
+        if requirement in ["joinDays_max", "joinDays_min"]:
+            return bound(self.COST_MEMBER, "durationDays", lambda ctx: ctx.member_dict["durationDays"], compare)
+        if requirement in ["completedTimes_max", "completedTimes_min"]:
+            return bound(self.COST_MEMBER, "completedTimes", lambda ctx: ctx.member_dict["completedTimes"], compare)
+        if requirement in ["drop_total_max", "drop_total_min"]:
+            return bound(
+                self.COST_MEMBER,
+                "drop_total",
+                lambda ctx: ctx.member_dict["durationDays"] - ctx.member_dict["completedTimes"],
+                compare,
+            )
+        if requirement in ["drop_this_week_max", "drop_this_week_min"]:
+            return bound(self.COST_RANK, "drop_this_week", lambda ctx: self.getDropThisWeek(ctx.member_dict["uniqueId"]), compare)
+        if requirement in ["drop_last_week_max", "drop_last_week_min"]:
+            return bound(self.COST_RANK, "drop_last_week", lambda ctx: self.getDropLastWeek(ctx.member_dict["uniqueId"]), compare)
+
+        if requirement == "liked":
+            def predicate(ctx: MemberContext) -> bool:
+                ctx.refer_dict["liked"] = ctx.getProfile("todayLikedState")
+                return ctx.getProfile("todayLikedState") == content
+            return self.COST_PROFILE, predicate
+        if requirement == "deskmate_min":
+            return bound(self.COST_PROFILE, "deskmate_min", lambda ctx: ctx.getProfile("deskmateDays"), operator.ge)
+        if requirement == "dependability":
+            # tag为-1表示未组队，3表示靠谱
+            def predicate(ctx: MemberContext) -> bool:
+                tag = ctx.getProfile("tag")
+                ctx.refer_dict["dependability_tag(-1未组队,3靠谱)"] = tag
+                return (tag in [-1, 3]) == bool(content)
+            return self.COST_PROFILE, predicate
+        if requirement == "group_nickname":
+            # 要求为真时需要改过班内昵称，为假时需要没有改过
+            def predicate(ctx: MemberContext) -> bool:
+                ctx.refer_dict["nickname"] = ctx.member_dict["nickname"]
+                ctx.refer_dict["name"] = ctx.getProfile("name")
+                return (ctx.getProfile("name") != ctx.member_dict["nickname"]) == bool(content)
+            return self.COST_PROFILE, predicate
+
+        if requirement == "daka_history":
+            required_durationDays_min = content.get("durationDays_min", 0)
+            required_finishingRate_min = content.get("finishingRate_min", 0)
+            def predicate(ctx: MemberContext) -> bool:
+                # 在任意一个其他小班中满足要求即可
+                accepted = False
+                for key, value in ctx.getTheirClasses().items():
+                    ctx.refer_dict[f"class{key} durationDays"] = value["durationDays"]
+                    ctx.refer_dict[f"class{key} finishingRate"] = value["finishingRate"]
+                    if value["durationDays"] > required_durationDays_min and value["finishingRate"] > required_finishingRate_min:
+                        ctx.refer_dict[f"class{key} accept"] = True
+                        accepted = True
+                return accepted
+            return self.COST_GROUPS, predicate
+        return None
+
+    def buildRankIndex(self, rank_dict: dict) -> dict:
+        '''每轮获取周榜后调用一次，预先计算本周与上周的漏卡天数，返回{'1': {uniqueId: 本周漏卡}, '2': {uniqueId: 上周漏卡}}'''
+        weekday_count = datetime.now().isoweekday()
+        return {
+            # 本周漏卡：今天没打卡不算漏卡，所以可能出现-1；入班天数小于本周已有天数时，用入班天数-打卡天数
+            '1': {
+                person["uniqueId"]: min(person["durationDays"], weekday_count) - person["completedTimes"] - 1
+                for person in rank_dict.get('1', [])
+            },
+            # 上周漏卡：外层的max是为了防止本周入班的同学出现负数
+            '2': {
+                person["uniqueId"]: max(min(person["durationDays"] - weekday_count, 7) - person["completedTimes"], 0) - 1
+                for person in rank_dict.get('2', [])
+            },
+        }
+
+    def getDropThisWeek(self, unique_id: int) -> int | None:
+        '''本周漏卡天数，周榜中找不到该成员时返回None'''
+        return self.rank_index['1'].get(unique_id)
+
+    def getDropLastWeek(self, unique_id: int) -> int | None:
+        '''上周漏卡天数，周榜中找不到该成员时返回None'''
+        return self.rank_index['2'].get(unique_id)
+
+    def checkUserProfile(self, member_dict: dict, unauthorized_token: str) -> dict:
         # 通信等价操作：点击了用户主页
-        # 本函数不可直接调用，请调用check
-        # <重要变量1> member_dict是这个用户在self.my_group_dict中截取出的，用户在我的班级的信息，是单个用户的
-        self.personal_dict = self.bcz.getUserInfoRAW(member_dict["uniqueId"], unauthorized_token)
-        # <重要变量2> self.personal_dict 是通过uniqueId得到的， 这个用户的个人信息，也是单个用户的
-        time.sleep(3)
-        # print(self.personal_dict["tag"])
-        print (f'<1>原名{self.personal_dict["name"]}，同桌{self.personal_dict["deskmateDays"]}天，\
-            打卡/入班时间{time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(member_dict["completedTime"]+28800))}，总卡{self.personal_dict["dakaDays"]},\
-            {"对方将您拉黑," if self.personal_dict["userInHisBlackList"]  else ""},\
-            {"违规," if self.personal_dict["todayStudyCheat"]  else ""},\
-            {"已点赞," if self.personal_dict["todayLikedState"]  else ""},\
-            总赞{self.personal_dict["likedCount"]},\
-            {"未组队," if self.personal_dict["tag"] == -1 else ""},\
-            {"靠谱," if self.personal_dict["tag"] == 3 else ""},\
-            {""}')
-
+        # 本函数由MemberContext在缓存过期时调用，请求间隔由BCZ内的限速器统一控制
+        personal_dict = self.bcz.getUserInfoRAW(member_dict["uniqueId"], unauthorized_token)
         # 默认gmtime总是比北京时间少8个小时（28800秒）
-
-        return 
-
-
-
-    def __checkUserGroups(self, refer_dict:dict, member_dict: dict, strata_name: str, unauthorized_token: str, durationDays_min: int) -> None:
+        logger.debug(
+            f'{member_dict["uniqueId"]}原名{personal_dict["name"]}，同桌{personal_dict["deskmateDays"]}天，'
+            f'打卡/入班时间{time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(member_dict["completedTime"]+28800))}，'
+            f'总卡{personal_dict["dakaDays"]}，总赞{personal_dict["likedCount"]}'
+        )
+        self.sqlite.saveFilterCache(member_dict["uniqueId"], {'profile': personal_dict})
+        return personal_dict
+
+    def checkUserGroups(self, ctx: MemberContext) -> dict:
         # 通信等价操作：进入了用户小班主页，但没有加入其小班，不过过程少了一些包
-        # 本函数不可直接调用，请调用check
-        strat = self.strategies[strata_name]
-        logging("__checkUserGroups")
-        
-        durationDays_min = strat["their_cls_chk_min"]# 只有他在展示班大于该值，才会继续验证他的展示班打卡数
-
-        # 以下巨大的代码块作用：找用户在其他小班内打卡/加入天数，储存到self.their_classes，C++风格（逃）
-        self.their_classes = {}
-        # <重要变量3> self.their_classes则负责保存找到的有用的信息，而class_detail只是依次读取这个用户的小班，储存他在别的班级的打卡数据
-        if self.personal_dict["userPrivacy"] == None:
-            show_group_id = self.personal_dict["list"][0]["id"]
+        # 本函数由MemberContext在需要时调用，返回用户在其他小班内打卡/加入天数，未过期的小班使用缓存
+        refer_dict = ctx.refer_dict
+        unique_id = ctx.member_dict["uniqueId"]
+        strat = self.strategy.get(self.strategy_index, {})
+        durationDays_min = strat.get("their_cls_chk_min", 0) # 只有他在展示班大于该值，才会继续验证他的展示班打卡数
+        their_classes = {}
+        class_list = ctx.getProfile("list") or []
+        if not class_list:
+            return their_classes
+        # 如果userPrivacy是NULL，那么就是第一个小班
+        user_privacy = ctx.getProfile("userPrivacy")
+        if user_privacy is None:
+            show_group_id = class_list[0]["id"]
             show_group_or_not = True
         else:
-            show_group_id = self.personal_dict["userPrivacy"]["groupId"]
-            show_group_or_not = self.personal_dict["userPrivacy"]["showGroup"]
-        # 如果userPrivacy是NULL，那么就是第一个小班
+            show_group_id = user_privacy["groupId"]
+            show_group_or_not = user_privacy["showGroup"]
 
-        print("<2>")
-        if (strat.get("experimental", False)):
-        # 实验功能：警告！请勿滥用实验功能，否则可能触发包括不限于反爬、封禁bcz账号或ip、追究法律责任等等后果
-        # 实验功能：警告！请勿滥用实验功能，否则可能触发包括不限于反爬、封禁bcz账号或ip、追究法律责任等等后果
-        # 实验功能：警告！请勿滥用实验功能，否则可能触发包括不限于反爬、封禁bcz账号或ip、追究法律责任等等后果
+        if strat.get("experimental", False):
+            # 实验功能：警告！请勿滥用实验功能，否则可能触发包括不限于反爬、封禁bcz账号或ip、追究法律责任等等后果
             refer_dict["experimental"] = True
-            for personal_class in self.personal_dict["list"]:
-                refer_dict[f'class{personal_class["id"]} joinDays'] = personal_class["joinDays"]
-                if personal_class["id"] == show_group_id: # 用户展示的小班，额外拉取，另，即使开隐私groupId也会有
-                    print("下面这行是用户展示的小班")
-                if personal_class["joinDays"] < durationDays_min : 
-                    refer_dict[f'class{personal_class["id"]} skip too short'] = True
-                    print(f'{personal_class["joinDays"]}天，跳过')
-                    continue # 没到最低标准，不验
-
-                class_detail = self.bcz.getMemberInfoRAW( unauthorized_token, personal_class["shareKey"])
-                time.sleep(3) # 每验一个等一秒
+            check_list = class_list
+        elif show_group_or_not:
+            # 传统模式：使用所有本来就能看到的信息进行筛选，只请求用户展示的小班
+            check_list = [personal_class for personal_class in class_list if personal_class["id"] == show_group_id]
+        else:
+            check_list = []
+
+        fetched = {}
+        for personal_class in check_list:
+            refer_dict[f'class{personal_class["id"]} joinDays'] = personal_class["joinDays"]
+            if personal_class["joinDays"] < durationDays_min:
+                refer_dict[f'class{personal_class["id"]} skip too short'] = True
+                continue # 没到最低标准，不验
+            field = f'class{personal_class["id"]}'
+            cached = ctx.getCache().get(field)
+            if cached and time.time() - cached[1] < self.CLASS_TTL:
+                stats = cached[0]
+            else:
+                stats = None # 不在该小班中(例如刚退出)时也缓存，避免重复请求
+                class_detail = self.bcz.getMemberInfoRAW(ctx.unauthorized_token, personal_class["shareKey"])
                 for person_in_their_class_dict in class_detail["members"]: # 获取用户在他的小班中的数据
-                    if person_in_their_class_dict["uniqueId"] == self.personal_dict["uniqueId"]: # 用uniqueid识别
-                        print(f'在别班{person_in_their_class_dict["completedTimes"]}/{person_in_their_class_dict["durationDays"]}')
-                        # 此处不加refer_dict，返回去还要
-                        self.their_classes[personal_class["id"]] = {
+                    if person_in_their_class_dict["uniqueId"] == unique_id: # 用uniqueid识别
+                        durationDays = person_in_their_class_dict["durationDays"]
+                        stats = {
                             "completedTimes": person_in_their_class_dict["completedTimes"],
-                            "durationDays" : person_in_their_class_dict["durationDays"],
-                            "finishingRate" : person_in_their_class_dict["completedTimes"]*1.000/person_in_their_class_dict["durationDays"],
-                            "rank" : personal_class["rank"] # 1-7青铜-王者，0教师
+                            "durationDays": durationDays,
+                            "finishingRate": person_in_their_class_dict["completedTimes"] / durationDays if durationDays else 0,
+                            "rank": personal_class["rank"], # 1-7青铜-王者，0教师
                         }
-        else: # 传统模式：使用所有本来就能看到的信息进行筛选
-            # experimental = 0
-            if show_group_or_not == 1: # 用户展示小班
-            # 如果userPrivacy是NULL，那么就是第一个小班，也就是展示
-                for personal_class in self.personal_dict["list"]:
-                    refer_dict[f'class{personal_class["id"]} joinDays'] = personal_class["joinDays"]
-                    # 简略变量：personal_class 这个人的class在其主页的概括信息，含有他加入了多少天等等简略信息
-                    if personal_class["id"] == show_group_id: # 只请求用户展示的小班
-                        if personal_class["joinDays"] < durationDays_min : 
-                            refer_dict[f'class{personal_class["id"]} skip too short'] = True
-                            print(f'展示班{personal_class["joinDays"]}天，跳过')
-                            break # 没到最低标准，不验了
-
-                        # 验证小班内他的打卡天数
-                        class_detail = self.bcz.getMemberInfoRAW( unauthorized_token, personal_class["shareKey"])
-                        # 遍历变量： class_detail 是这个人的每个小班的group_dict遍历变量
-                        time.sleep(3)
-                        for person_in_their_class_dict in class_detail["members"]: # 获取用户在他的小班中的数据
-                            # 遍历变量：person_in_their_class_dict 如上
-                            if person_in_their_class_dict["uniqueId"] == self.personal_dict["uniqueId"]: # 用uniqueid识别
-                                print(f'在别班{person_in_their_class_dict["completedTimes"]}/{person_in_their_class_dict["durationDays"]}')
-                                self.their_classes[personal_class["id"]] = {
-                                    "completedTime": person_in_their_class_dict["completedTimes"],
-                                    "durationDays" : person_in_their_class_dict["durationDays"],
-                                    "finishingRate" : person_in_their_class_dict["completedTimes"]*1.000/person_in_their_class_dict["durationDays"],
-                                    "rank" : personal_class["rank"] # 1-7青铜-王者，0教师
-                                }
-        return 
-
-
-    def check(self, member_dict: dict,strata_name:str, authorized_token: str, unauthorized_token: str, share_key: str) -> None:
-        # 通信等价操作：本函数先根据已有数据判断，需要更多资料时调用checkUserProfile和checkUserGroups 
-        # 通过任意一个子条件，那么在status:dict中储存对应信息方便上一级程序处理
-        # 如果不符合任何一个子条件，那么直接退出
-        print (f'正在验证{member_dict["nickname"]},id = {member_dict["uniqueId"]}')
+                        break
+                fetched[field] = stats
+            if stats is not None:
+                their_classes[personal_class["id"]] = stats
+        if fetched:
+            self.sqlite.saveFilterCache(unique_id, fetched)
+        return their_classes
+
+    def check(self, member_dict: dict, unauthorized_token: str) -> dict | None:
+        '''按编译好的策略验证成员，记录并返回第一个全部满足的子条目对应的处理结果，都不满足时返回None'''
         # strategies:很多策略的集合，strat：一个策略,sub_strat:一个策略下的子策略
-        strat = self.strategies[strata_name]
-
-        if (BCZ.config.status.get(member_dict["uniqueId"], None ) == None) : 
-            print("未检测过")
-        elif (BCZ.config.status[member_dict["uniqueId"]]["action"] == "accept"):
-            print("已通过，需要踢鸽老请重启程序")
+        unique_id = member_dict["uniqueId"]
+        # 验证由多个线程并发执行，self.status只在持锁时修改，策略在验证期间被替换时放弃本次结果
+        with self.rlock:
+            status = self.status.get(unique_id)
+            compiled, strategy_index, version = self.compiled, self.strategy_index, self.strategy_version
+        if status and status["action"] == "accept":
+            return status # 已通过，需要踢鸽老请重启程序
+
+        # 即便是kick状态也要重新判断，如果别人换了资料（传统模式）呢
+        ctx = MemberContext(self, member_dict, unauthorized_token)
+        for sub in compiled:
+            ctx.refer_dict = {}
+            if all(predicate(ctx) for predicate in sub['predicates']):
+                sub_strat = sub['strat']
+                status = {
+                    "memberId": member_dict["id"], # 踢人的时候要用
+                    "uniqueId": unique_id,
+                    "nickname": member_dict["nickname"],
+                    "action": sub_strat["action"],
+                    "strata_name": strategy_index,
+                    "sub_strata_name": sub['name'],
+                    "priority": sub_strat.get("priority", 1024),
+                    "delay": sub['delay'],
+                    "refer_dict": ctx.refer_dict,
+                }
+                with self.rlock:
+                    if version == self.strategy_version:
+                        self.status[unique_id] = status
+                logger.debug(f'{member_dict["nickname"]}({unique_id})符合标准{strategy_index}-{sub["name"]}')
+                return status
+        with self.rlock:
+            if version == self.strategy_version:
+                self.status.pop(unique_id, None)
+        return None
+
+    def getSignature(self, member_dict: dict) -> tuple:
+        '''成员签名，包含小班主页与周榜中会影响验证结果的全部字段'''
+        unique_id = member_dict["uniqueId"]
+        return tuple(member_dict[field] for field in self.MEMBER_FIELDS) + (
+            self.rank_index['1'].get(unique_id),
+            self.rank_index['2'].get(unique_id),
+        )
+
+    def diffMembers(self) -> dict:
+        '''对比上一次与本次查询的成员，返回事件{'join': 新加入, 'leave': 退出, 'daka': 打卡状态变化, 'change': 其他信息变化}，值为uniqueId集合'''
+        events = {'join': set(), 'leave': set(), 'daka': set(), 'change': set()}
+        if not self.prev_my_group_dict:
+            return events # 第一次查询时没有可以对比的数据
+        prev_members = {member_dict["uniqueId"]: member_dict for member_dict in self.prev_my_group_dict["members"]}
+        members = {member_dict["uniqueId"]: member_dict for member_dict in self.my_group_dict["members"]}
+        events['join'] = members.keys() - prev_members.keys()
+        events['leave'] = prev_members.keys() - members.keys()
+        for unique_id in members.keys() & prev_members.keys():
+            member_dict, prev_member_dict = members[unique_id], prev_members[unique_id]
+            if (member_dict["completedTime"], member_dict["todayStudyCheat"]) != (prev_member_dict["completedTime"], prev_member_dict["todayStudyCheat"]):
+                events['daka'].add(unique_id)
+            elif any(member_dict[field] != prev_member_dict[field] for field in self.MEMBER_FIELDS):
+                events['change'].add(unique_id)
+        return events
+
+    def selectCandidates(self, events: dict, incremental: bool = True) -> list[dict]:
+        '''处理成员事件并返回需要验证的成员，增量模式下只验证输入变化或验证结果过期的成员'''
+        with self.rlock:
+            for unique_id in events['leave']:
+                self.status.pop(unique_id, None)
+                self.verdicts.pop(unique_id, None)
+        if events['join'] or events['leave']:
+            logger.info(f'小班{self.shareKey}新加入{len(events["join"])}人，退出{len(events["leave"])}人')
+        if not incremental:
+            return self.my_group_dict["members"]
+        now = time.time()
+        candidates = []
+        for member_dict in self.my_group_dict["members"]:
+            verdict = self.verdicts.get(member_dict["uniqueId"])
+            if not verdict or verdict[0] != self.getSignature(member_dict) or now - verdict[1] >= self.verdict_ttl:
+                candidates.append(member_dict)
+        return candidates
+
+    def verify(self, member_list: list[dict], unauthorized_token: str, workers: int, new_members: set = frozenset()) -> None:
+        '''并发验证成员并记录验证结果，新加入的成员优先验证，请求速率由BCZ内的限速器统一控制'''
+        if not member_list:
             return
-        
-        
-
-        # 即便是Kicked状态也要重新判断，如果别人换了资料（传统模式）呢
-
-        
-        personal_dict_renewed = False # 能不更就不更，减少网络通信时间
-        their_classes_renewed = False
-
-
-        for sub_strata_name, sub_strat in strat.items():    
-            
-            refer_dict = {}
-            # 储存筛选参考数据
-            if sub_strata_name == "their_cls_chk_min":
-                durationDays_min = sub_strat
-            # if sub_strata_name == "delay":
-
-            elif sub_strata_name[0] == '*':# 这是一个子条目
-                # 满足所有条件为1，一旦检出一个不合格即o = 0
-                o = 1
-                for requirement, content in sub_strat["requirement"].items():
-                    if requirement == "daka_today" and content :
-                        refer_dict["completedTime"] = member_dict["completedTime"] # 就是个0
-                        if member_dict["completedTime"] == 0:# 今天，  打卡了吗？
-                            o = 0
-                            print(f'failed:未打卡，{member_dict["completedTime"]}')
-                            break
-                    elif requirement == "daka_today" and not content :
-                        refer_dict["completedTime"] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(member_dict["completedTime"]+28800))
-                        if member_dict["completedTime"] != 0:# 今天，  打卡了吗？
-                            o = 0
-                            print(f'failed:已打卡，{member_dict["completedTime"]}')
-                            break
-                        
-                    elif requirement == "is_cheat" :
-                        refer_dict["is_cheat"] = 0
-                        if not member_dict["todayStudyCheat"] :
-                            o = 0
-                            print("failed:未违规")
-                            
-                            break
-                    elif requirement == "is_not_cheat" :
-                        refer_dict["is_cheat"] = 1
-                        if member_dict["todayStudyCheat"]:
-                            o = 0
-                            print("failed:违规")
-
-                            break
-                    elif requirement == "joinDays_max" :
-                        refer_dict["durationDays"] = member_dict["durationDays"]
-                        if member_dict["durationDays"] > content:# 总榜
-                            o = 0
-                            print(f'failed:超过joinDays_max，{member_dict["durationDays"]}/{content}')
-                            break
-                    elif requirement == "joinDays_min" :
-                        refer_dict["durationDays"] = member_dict["durationDays"]
-                        if member_dict["durationDays"] < content:# 总榜
-                            o = 0
-                            print(f'failed:不足joinDays_min，{member_dict["durationDays"]}/{content}')
-                            break
-                    elif requirement == "completedTimes_max" :
-                        refer_dict["completedTimes"] = member_dict["completedTimes"]
-                        if member_dict["completedTimes"] > content:# 总榜
-                            o = 0
-                            print(f'failed:超过completedTimes_max，{member_dict["completedTimes"]}/{content}')
-                            break
-                    elif requirement == "completedTimes_min" :
-                        refer_dict["completedTimes"] = member_dict["completedTimes"]
-                        if member_dict["completedTimes"] < content:# 总榜
-                            o = 0
-                            print(f'failed:不足completedTimes_min，{member_dict["completedTimes"]}/{content}')
-                            break
-                    elif requirement == "drop_total_max" :
-                        refer_dict["drop_total_max"] = member_dict["durationDays"] - member_dict["completedTimes"]
-                        if member_dict["durationDays"] - member_dict["completedTimes"] > content:
-                            o = 0
-                            print(f'failed:总榜漏卡超过{content}天')
-                            break
-                    elif requirement == "drop_total_min" :
-                        refer_dict["drop_total_max"] = member_dict["durationDays"] - member_dict["completedTimes"]
-                        if member_dict["durationDays"] - member_dict["completedTimes"] < content:
-                            o = 0
-                            print(f'failed:总榜漏卡不足{content}天')
-                            break
-                    elif requirement == "drop_this_week_max" or requirement == "drop_this_week_min":# 排行榜有关事宜
-
-                    # <重要变量4> self.my_rank_dict 是我的小班周榜，在run函数已经读取的，实例内通用
-                    # <重要变量5> self.my_group_dict 是我的小班主页，run函数读取，member_dict是其子集
-                        for person_in_my_class_dict in self.my_rank_dict: # 获取用户在我的小班中的周榜，本周
-                        # 遍历变量：person_in_my_class_dict 如上
-                            if person_in_my_class_dict["uniqueId"] == member_dict["uniqueId"]: # 用uniqueid识别
-                                weekday_count = int(time.strftime("%w"))
-                                if weekday_count == 0 : # 星期日
-                                    weekday_count = 7
-
-                                drop_this_week = min(person_in_my_class_dict["durationDays"], weekday_count)\
-                                            - person_in_my_class_dict["completedTimes"]
-                                        # drop_this_week解释：如果入班天数小于本周已有天数，那么用入班天数-打卡天数即为本周漏卡天数
-                                drop_this_week -= 1 # 今天没打卡不算漏卡，所以可能出现-1
-                                
-                                refer_dict["drop_this_week"] = drop_this_week
-                                if requirement == "drop_this_week_max" and drop_this_week > content:
-                                    o = 0
-                                    print (f"failed:本周榜漏卡{drop_this_week}，要求max{content}")
-                                    break
-                                elif requirement == "drop_this_week_min" and drop_this_week < content:
-                                    o = 0
-                                    print (f"failed:本周榜漏卡{drop_this_week}，要求min{content}")
-                                    break
-
-                    elif requirement == "drop_last_week_max" or requirement == "drop_last_week_min":
-                        for person_in_my_class_dict in self.my_rank_dict["2"]: # 获取用户在我的小班中的周榜，上周
-
-                            if person_in_my_class_dict["uniqueId"] == member_dict["uniqueId"]:
-                                weekday_count = int(time.strftime("%w"))
-                                if weekday_count == 0 : # 星期日
-                                    weekday_count = 7
-
-                                drop_last_week = max(min(person_in_my_class_dict["durationDays"] - weekday_count, 7)\
-                                                - person_in_my_class_dict["completedTimes"], 0)
-                                #外层的max是为了防止本周入班的同学出现负数
-                                drop_last_week -= 1  # 今天没打卡不算漏卡，所以可能出现-1
-
-                                refer_dict["drop_last_week"] = drop_last_week
-                                if requirement == "drop_last_week_max" and drop_last_week > content:
-                                    o = 0
-                                    print (f"failed:上周榜漏卡{drop_last_week}，要求max{content}")
-                                    break
-                                elif requirement == "drop_last_week_min" and drop_last_week < content:
-                                    o = 0
-                                    print (f"failed:上周榜漏卡{drop_last_week}，要求min{content}")
-                                    break
-
-                    else: # 以下都是要用 personal_dict的，所以要先调用..
-                        if not personal_dict_renewed: 
-                            self.__checkUserProfile(refer_dict, member_dict, strata_name, unauthorized_token)
-                            personal_dict_renewed = True
-
-                        if requirement == "liked" :
-                            refer_dict["liked"] = self.personal_dict["todayLikedState"]
-                            if self.personal_dict["todayLikedState"] != content:
-                                o = 0
-                                print(f'failed:点赞{self.personal_dict["todayLikedState"]}/{content}')
-                                break
-                        elif requirement == "deskmate_min" :
-                            refer_dict["deskmate_min"] = self.personal_dict["deskmateDays"]
-                            if self.personal_dict["deskmateDays"] < content:
-                                o = 0
-                                print(f'failed:同桌不够，{self.personal_dict["deskmateDays"]}/{content}')
-                                break
-                        elif requirement == "dependability" and content :
-                            refer_dict["dependability_status(-1未组队)"] = self.personal_dict["tag"]
-                            refer_dict["dependability_tag(3靠谱)"] = self.personal_dict["tag"]
-
-                            if self.personal_dict["tag"] != -1 and self.personal_dict["tag"] != 3:
-                                o = 0
-                                print(f'failed:无靠谱头像框，{self.personal_dict["tag"]}，{self.personal_dict["tag"]}')
-                                break
-                        elif requirement == "dependability" and not content :
-                            refer_dict["dependability_status(-1未组队)"] = self.personal_dict["tag"]
-                            refer_dict["dependability_tag(3靠谱)"] = self.personal_dict["tag"]
-                            if (self.personal_dict["tag"] == -1 or self.personal_dict["tag"] == 3):
-                                o = 0
-                                print(f'failed:有靠谱头像框或未组队，{self.personal_dict["tag"]}，{self.personal_dict["tag"]}')
-                                break
-                        elif requirement == "group_nickname" and content :
-                            refer_dict["nickname"] = self.member_dict["nickname"]
-                            refer_dict["name"] = self.personal_dict["name"]
-                            if self.personal_dict["name"] == member_dict["nickname"]:# 是否改了小班昵称
-                                o = 0
-                                print("failed:未改昵称")
-                                break
-                        elif requirement == "group_nickname" and not content :
-                            refer_dict["nickname"] = self.member_dict["nickname"]
-                            refer_dict["name"] = self.personal_dict["name"]
-                            if self.personal_dict["name"] == member_dict["nickname"]:
-                                o = 0
-                                print("failed:已经改昵称")
-                                break
-                        else:
-                            if not their_classes_renewed : 
-                                self.__checkUserGroups(refer_dict, member_dict, strata_name, unauthorized_token, durationDays_min)
-                                # checkUserGroups也要用到personal_dict，所以放在这里
-                                their_classes_renewed = True
-                            
-
-                            if requirement == "daka_history":# 下面的缩进块是用来找出self.their_classes中满足指定天数的
-
-                                required_durationDays_min = content.get("durationDays_min",  0) # 先从strata中读出最小要求天数
-                                required_finishingRate_min = content.get("finishingRate_min",  0)
-                                oo = 0 # 检出一个合格即合格
-                                for key, value in self.their_classes.items():
-                                    refer_dict[f"class{key} durationDays"] = value["durationDays"]
-                                    refer_dict[f"class{key} finishingRate"] = value["finishingRate"]
-                                    if (value["durationDays"] > required_durationDays_min and value["finishingRate"] > required_finishingRate_min):
-                                        oo = 1 # 满足条件啦
-                                        refer_dict[f"class{key} accept"] = True
-                                if oo == 0 :
-                                    o = 0 # 没有任何合格的小班，这人没了
-
-                                    print(f'failed:小班不符合要求，total{required_durationDays_min}rate{required_finishingRate_min}')
-                                    break
-
-                        
-                if o == 1:
-                    print(f"符合标准{strata_name}-{sub_strata_name}")
-                    if sub_strat["action"] == "accept":
-                        print("✓ Accepted")
-                    # status不会保存，只留在内存中，毕竟可能以后还要再筛漏卡的
-                    BCZ.config.status[f"{sub_strat.get('priority', 1024)}.{sub_strata_name}.{member_dict['uniqueId']}"] = {
-                        "memberId":member_dict["id"], # 踢人的时候要用
-                        "uniqueId":member_dict["uniqueId"],
-                        "nickname":member_dict["nickname"],
-                        "action":sub_strat["action"],
-                        "strata_name": strata_name,
-                        "sub_strata_name":sub_strata_name,
-                        "priority":sub_strat.get("priority", 1024),
-                        "refer_dict":refer_dict
-                    }
-                    return 
-                else:
-                    print(f"不符合标准，不符合标准{strata_name}-{sub_strata_name}")
-                    
-        
-        print("No self.strategies matched. Check it out.")
-        return 
-
-
-    def run(self, authorized_token: str, unauthorized_token: str, share_key: str, strata_name: str) -> None:
-        
-        self.my_group_dict = {} # 小组成员信息
-        self.my_rank_dict = {} # 排名榜
-        self.prev_my_group_dict = {} # 上一个
-
-        self.rlock.acquire()
-        self.activate = True
-        # 监听标志，self.active是筛选激活标志
-        self.rlock.release()
-
-        strat = self.strategies.get(strata_name,{})
-        # print(strat)
-        print(strata_name)
-
-        delay1 = self.strategies[strata_name]["delay1"]
-        delay2 = self.strategies[strata_name]["delay2"] # 在小班档案页面和成员管理页面分别停留的时间，单位s
-        if (delay1 < 3): delay1 = 3 # 保护措施，不知道会不会触发反爬措施
-        if (delay2 < 3): delay2 = 3 
-
-        start_time_h = strat.get("start_time_h", 0)
-        start_time_m = strat.get("start_time_m", 0)
-
-        while self.monitor :
-            # print(unauthorized_token)
-            self.prev_my_group_dict = self.my_group_dict # 上一次查询的
-            self.my_group_dict = self.bcz.getMemberInfoRAW(unauthorized_token, share_key)
-            # 推荐全部使用unauth 方便对比班内昵称
-            self.my_rank_dict = self.bcz.getRankInfoRAW(authorized_token, share_key)
-            time.sleep(delay1)
-            for member_dict in self.my_group_dict["members"]:
-
-                now = datetime.datetime.now() # datetime可以直接获得int值
-                
-                # 本回合可以踢出的人数，根据priority从小到大踢出
-
-                self.check(member_dict, strata_name, authorized_token, unauthorized_token, share_key)
-
-
-            # print(BCZ.config.status)
-            # print(BCZ.config.status.items())
-
-            # sort_list = []
-            # for uniqueId, personal_status in BCZ.config.status.items():
-            #     sort_list.append({"uniqueId":uniqueId,"priority":personal_status["priority"],"sub_strata_name":personal_status["sub_strata_name"]})
-            # sort_list = sorted(sort_list, key = itemgetter("priority","sub_strata_name"), reverse = False)
-            # print(sort_list)
-            # return
-
-            # BCZ.config.status = sorted(BCZ.config.status, key = itemgetter("priority","sub_strata_name"), reverse = False)
-            # # 报错TypeError: string indices must be integers, not 'str'
-            # BCZ.config.status = sorted(BCZ.config.status.items(), key = itemgetter("priority","sub_strata_name"), reverse = False)
-            # # 报错TypeError: tuple indices must be integers or slices, not str
-            # BCZ.config.status = sorted(dict(BCZ.config.status), key = itemgetter("priority","sub_strata_name"), reverse = False)
-            # BCZ.config.status = sorted(BCZ.config.status.items(), key = lambda x:x[0], reverse = False)
-            # print(BCZ.config.status)
-            
-            kickcount = self.my_group_dict["groupInfo"]["memberCount"] - strat["membercnt_min"]
-
-            kickcount = 3
-
-            BCZ.config.status = OrderedDict(sorted(BCZ.config.status.items(), key=lambda x: x[0]))
-
-            for uniqueId_tag, member_status in BCZ.config.status.items():
-
-                
-                # 重要变量 member_status 是在check完后生成的结果
-                actiondelay = strat[member_status["sub_strata_name"]].get("delay", 0)
+        tasks = queue.PriorityQueue()
+        for order, member_dict in enumerate(member_list):
+            tasks.put((0 if member_dict["uniqueId"] in new_members else 1, order, member_dict))
+
+        def worker() -> None:
+            while self.activate:
+                try:
+                    _, _, member_dict = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    signature = self.getSignature(member_dict)
+                    version = self.strategy_version
+                    self.check(member_dict, unauthorized_token)
+                    with self.rlock:
+                        if version == self.strategy_version:
+                            self.verdicts[member_dict["uniqueId"]] = (signature, time.time())
+                except Exception as e:
+                    logger.warning(f'验证{member_dict["nickname"]}({member_dict["uniqueId"]})时发生错误: {e}')
+
+        workers = max(min(int(workers), len(member_list)), 1)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Filter') as executor:
+            for _ in range(workers):
+                executor.submit(worker)
+
+    def run(self, authorized_token: str, unauthorized_token: str, share_key: str) -> None:
+        while self.activate:
+            # 策略可能在运行期间被重新应用，每轮重新读取
+            with self.rlock:
+                strat = self.strategy.get(self.strategy_index, {})
+            # 两次轮询之间的间隔，单位s，不低于MIN_POLL_INTERVAL，单个请求之间的速率由BCZ内的限速器控制
+            delay2 = max(strat.get("delay2", 0), self.MIN_POLL_INTERVAL)
+            verify_workers = strat.get("verify_workers", 4) # 同时验证的成员数
+            incremental = strat.get("incremental", True) # 为False时每轮重新验证全部成员
+            start_time_h = strat.get("start_time_h", 0)
+            start_time_m = strat.get("start_time_m", 0)
+            try:
+                self.prev_my_group_dict = self.my_group_dict # 上一次查询的
+                self.my_group_dict = self.bcz.getMemberInfoRAW(unauthorized_token, share_key)
+                # 推荐全部使用unauth 方便对比班内昵称
+                self.my_rank_dict = self.bcz.getRankInfoRAW(authorized_token, share_key)
+                self.rank_index = self.buildRankIndex(self.my_rank_dict)
+                events = self.diffMembers()
+                candidates = self.selectCandidates(events, incremental)
+                self.verify(candidates, unauthorized_token, verify_workers, events['join'])
+                logger.debug(f'小班{self.shareKey}本轮验证{len(candidates)}/{len(self.my_group_dict["members"])}人')
+            except Exception as e:
+                logger.error(f'筛选小班{share_key}时发生错误: {e}')
+                time.sleep(delay2)
+                continue
+
+            now = datetime.now()
+            kickcount = self.my_group_dict["groupInfo"]["memberCount"] - strat.get("membercnt_min", 0)
+            kickcount = 3 # 保护措施，每轮最多踢出的人数
+            # 本回合可以踢出的人数，根据priority从小到大踢出
+            with self.rlock:
+                status_list = sorted(self.status.values(), key=lambda x: (x["priority"], x["sub_strata_name"]))
+            for member_status in status_list:
+                actiondelay = member_status["delay"]
                 # 不写delay 默认立即执行，因为操作人数多，这个不太好delay
                 if member_status["action"] == "accept":
-                    print("✓ Accepted")
                     time.sleep(actiondelay)
-
                 elif member_status["action"] == "kick":
-                    if not self.active:
-                        print ("× Since not activated, the person will not be kicked.")
-                    elif now.hour < start_time_h or now.minute < start_time_m:
-                        print(f"× Not started yet.Time{now.hour}{now.minute}，start@{start_time_h}{start_time_m}")
+                    if (now.hour, now.minute) < (start_time_h, start_time_m):
+                        logger.info(f'未到开始时间{start_time_h:02d}:{start_time_m:02d}，暂不踢出{member_status["nickname"]}')
                     elif kickcount > 0:
                         kickcount -= 1
                         time.sleep(actiondelay)
-                        # self.bcz.removeMembers([member_dict["id"]], share_key, authorized_token)
+                        # self.bcz.removeMembers([member_status["memberId"]], share_key, authorized_token)
                         # 保护措施，先不真正执行
-                        print ("踢出了！")
-                        # self.prev_my_group_dict = self.bcz.getMemberInfoRAW()
-
-            
-            # self.my_group_dict = self.bcz.getMemberInfoRAW(unauthorized_token, share_key)
+                        logger.info(f'踢出了{member_status["nickname"]}({member_status["uniqueId"]})！')
             time.sleep(delay2)
 
-        self.rlock.acquire()
-        self.monitor = False
-        self.rlock.release()
-            
-
-
-
-
-
     def start(self, authorized_token: str, unauthorized_token: str, share_key: str, strata_name: str) -> None:
         # 是否验证？待测试，如果没有那就可怕了
         self.stop() # 防止重复运行
 
-        # print(unauthorized_token)
-        # 仅此处允许复制一次BCZ.config.config的self.strategies字典
-        self.strategies = BCZ.config.config["default_strategies"]
-
-        if self.strategies.get(strata_name,  "") == "":
-            print(f"无名为{strata_name}策略，请设置")
-        else:
-            self.tids = threading.Thread(target=self.run, args=(authorized_token, unauthorized_token, share_key, strata_name))
-            self.tids.start()
-
-
+        if strata_name not in self.strategy:
+            logger.warning(f'无名为{strata_name}策略，请设置')
+            return
+        self.applyStrategy(strata_name)
+        self.sqlite.deleteFilterCache(max(max(self.PROFILE_TTL.values()), self.CLASS_TTL))
+        self.activate = True
+        self.tids = threading.Thread(target=self.run, args=(authorized_token, unauthorized_token, share_key), daemon=True)
+        self.tids.start()
@@ -0,0 +1,149 @@
+import time
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        '''令牌桶，rate为每秒补充的令牌数，capacity为可以连续发出的请求数'''
+        self.rate = rate
+        self.capacity = capacity
+        self.scale = 1.0                            # 自适应退避系数，请求失败时减半，成功时缓慢恢复
+        self.tokens = capacity
+        self.update_time = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        '''按经过的时间补充令牌'''
+        self.tokens = min(self.capacity, self.tokens + (now - self.update_time) * self.rate * self.scale)
+        self.update_time = now
+
+    def reserve(self) -> float:
+        '''预定一个令牌并返回需要等待的秒数，令牌不足时透支，由调用方等待到令牌补足'''
+        self.refill(time.monotonic())
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / (self.rate * self.scale)
+
+class RateLimiter:
+    def __init__(self, token_rate: float, host_rate: float, min_scale: float = 1 / 16) -> None:
+        '''请求限速类，每个令牌与每个域名各有一个令牌桶，请求需同时从两个桶中取得令牌'''
+        self.token_rate = token_rate
+        self.host_rate = host_rate
+        self.min_scale = min_scale                  # 连续失败时速率最低降至原来的比例
+        self.recover_step = 0.1                     # 每次成功恢复的速率比例
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def getBuckets(self, url: str, token: str) -> list[TokenBucket]:
+        '''获取请求对应的令牌桶，不存在时创建，仅内部调用'''
+        keys = [
+            ('host', urlparse(url).netloc, self.host_rate),
+            ('token', token, self.token_rate),
+        ]
+        buckets = []
+        for kind, key, rate in keys:
+            if (kind, key) not in self.buckets:
+                self.buckets[(kind, key)] = TokenBucket(rate, max(rate, 1))
+            buckets.append(self.buckets[(kind, key)])
+        return buckets
+
+    def reserve(self, url: str, token: str) -> float:
+        '''预定一次请求并返回需要等待的秒数'''
+        with self.lock:
+            return max(bucket.reserve() for bucket in self.getBuckets(url, token))
+
+    def acquire(self, url: str, token: str) -> float:
+        '''等待到可以发出请求，返回等待的秒数'''
+        wait = self.reserve(url, token)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def asyncAcquire(self, url: str, token: str) -> float:
+        '''acquire的异步版本，等待时不阻塞事件循环'''
+        wait = self.reserve(url, token)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def feedback(self, url: str, token: str, ok: bool) -> None:
+        '''根据请求结果调整速率，失败时速率减半并清空余量，成功时逐步恢复'''
+        with self.lock:
+            for bucket in self.getBuckets(url, token):
+                bucket.refill(time.monotonic())
+                if ok:
+                    bucket.scale = min(1.0, bucket.scale + self.recover_step)
+                else:
+                    bucket.scale = max(self.min_scale, bucket.scale / 2)
+                    bucket.tokens = min(bucket.tokens, 0)
+        if not ok:
+            logger.debug(f'请求{urlparse(url).netloc}失败，降低请求速率')
+
+    def getInfo(self) -> dict:
+        '''获取各域名当前的速率比例'''
+        with self.lock:
+            return {key: bucket.scale for (kind, key), bucket in self.buckets.items() if kind == 'host'}
+
+class TokenPool:
+    def __init__(self, main_token: str, fail_limit: int = 3, cooldown: float = 60) -> None:
+        '''关注小班授权令牌的健康状态，批量请求改用各小班自己的令牌以分担主令牌的请求量
+
+        只能用于返回内容与查看者无关的请求(小班周榜)，小班主页的公开视角、用户校牌等仍需使用主令牌
+        '''
+        self.main_token = main_token
+        self.fail_limit = fail_limit                # 连续失败多少次后暂停使用该令牌
+        self.cooldown = cooldown                    # 暂停秒数，再次被暂停时翻倍
+        self.tokens = {}                            # {令牌: {'fail': 连续失败次数, 'strike': 被暂停次数, 'until': 暂停至, 'count': 使用次数}}
+        self.main_count = 0                         # 改用主令牌的次数
+        self.lock = threading.Lock()
+
+    def sync(self, tokens: list[str]) -> None:
+        '''以当前有效关注小班的令牌重建可用集合，已存在的令牌保留其状态，已移除或重新授权的旧令牌不再使用'''
+        with self.lock:
+            self.tokens = {
+                token: self.tokens.get(token, {'fail': 0, 'strike': 0, 'until': 0, 'count': 0})
+                for token in tokens
+                if token and token != self.main_token
+            }
+
+    def choose(self, token: str) -> str:
+        '''小班令牌可用时返回该令牌，未同步、已暂停或为空时改用主令牌'''
+        with self.lock:
+            state = self.tokens.get(token)
+            if state and state['until'] <= time.monotonic():
+                state['count'] += 1
+                return token
+            self.main_count += 1
+            return self.main_token
+
+    def feedback(self, token: str, ok: bool) -> None:
+        '''记录令牌的请求结果，连续失败的令牌暂停使用，主令牌不会被暂停'''
+        with self.lock:
+            state = self.tokens.get(token)
+            if not state:
+                return
+            if ok:
+                state['fail'] = 0
+                state['strike'] = 0
+                return
+            state['fail'] += 1
+            if state['fail'] >= self.fail_limit:
+                state['until'] = time.monotonic() + self.cooldown * 2 ** state['strike']
+                state['strike'] += 1
+                state['fail'] = 0
+                logger.warning(f'有授权令牌连续{self.fail_limit}次请求失败，暂停使用{self.cooldown * 2 ** (state["strike"] - 1):.0f}秒')
+
+    def getInfo(self) -> dict:
+        '''获取令牌池状态'''
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'total': len(self.tokens),
+                'healthy': sum(1 for state in self.tokens.values() if state['until'] <= now),
+                'main_count': self.main_count,
+                'other_count': sum(state['count'] for state in self.tokens.values()),
+            }
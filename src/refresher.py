@@ -0,0 +1,45 @@
+import time
+import logging
+import threading
+import traceback
+
+from src.bcz import BCZ, refreshTempMemberTable
+from src.config import Config
+from src.sqlite import SQLite
+
+logger = logging.getLogger(__name__)
+
+class Refresher:
+    def __init__(self, config: Config, bcz: BCZ, sqlite: SQLite) -> None:
+        '''后台刷新类，定期刷新超过刷新间隔的关注小班，请求处理时直接读取最近一次的数据'''
+        self.config = config
+        self.bcz = bcz
+        self.sqlite = sqlite
+        self.running = False
+        self.thread = threading.Thread(
+            target=self.run,
+            daemon=True,
+        )
+        self.thread.setName('Refresher')
+
+    def start(self) -> None:
+        '''启动后台刷新'''
+        if int(self.config.refresh_second) <= 0:
+            logger.info('未开启后台刷新，将在查询时同步刷新实时数据')
+            return
+        logger.info(f'启动后台刷新，每个小班的刷新间隔为{self.config.refresh_second}秒')
+        self.running = True
+        self.thread.start()
+
+    def run(self) -> None:
+        '''每秒检查一次，只有超过刷新间隔的小班会被刷新，有小班获取失败时等待一个刷新间隔再重试'''
+        while True:
+            interval = 1
+            try:
+                group_list = refreshTempMemberTable(self.bcz, self.sqlite, max_age=int(self.config.refresh_second))
+                if any(group.get('exception') for group in group_list):
+                    interval = int(self.config.refresh_second)
+            except:
+                traceback.print_exc()
+                interval = int(self.config.refresh_second)
+            time.sleep(interval)
@@ -3,8 +3,13 @@ import sys
 import math
 import time
 import logging
+import json
+import base64
+import queue
 import sqlite3
+import threading
 from datetime import datetime
+from contextlib import contextmanager
 
 from src.config import Config
 
@@ -15,6 +20,24 @@ class SQLite:
         '''数据库类'''
         self.db_path = config.database_path
         self.cache_second = config.cache_second
+        self.busy_timeout = 10000                   # 等待写锁的毫秒数
+        self.cache_size = 16384                     # 每个连接的页缓存KiB
+        self.pool_size = 8                          # 连接池最多保留的空闲连接数，并发超出时临时建立的连接用完即关闭
+        self.pool = queue.LifoQueue(maxsize=self.pool_size)
+        self.local = threading.local()              # 当前线程借出的连接，同一线程内嵌套调用共用
+        self.count_cache = {}                       # 查询计数缓存 {(语句, 参数): (计数, 时间)}
+        self.count_lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.group_hash = {}                        # 关注小班上次写入的接口数据的哈希 {小班ID: 哈希}
+        self.member_hash = {}                       # 临时表成员上次写入内容的哈希 {小班ID: {用户ID: (记录日期, 哈希)}}
+        self.temp_data_time = {}                    # 临时表各小班最近一次刷新的采集时间 {小班ID: 时间戳}，与表中的MAX(DATA_TIME)一致，避免每次查询
+        self.observe_cache = None                   # 关注小班表缓存 (读取时间, 全部小班列表)
+        self.observe_cache_hit = 0
+        self.observe_cache_miss = 0
+        self.observe_lock = threading.Lock()
+        self.fts_supported = self.checkFts()        # 当前SQLite是否支持trigram分词，升级SQLite后重启即会补建全文索引
+        if path := os.path.dirname(self.db_path):
+            os.makedirs(path, exist_ok=True)
         self.init_sql = [
             '''CREATE TABLE IF NOT EXISTS GROUPS (                   -- 小班表
                 GROUP_ID INTEGER,                   -- 小班ID
@@ -89,14 +112,200 @@ class SQLite:
                 VALID INTEGER                       -- 是否有效
             );'''
         ]
+        # 数据库迁移，按顺序对应版本号1, 2, 3...，当前版本记录在PRAGMA user_version，只允许追加
+        self.migrate_sql = [
+            [   # 版本1: 去除重复数据，增加唯一键与查询索引
+                '''DELETE FROM MEMBERS WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM MEMBERS GROUP BY USER_ID, GROUP_ID, TODAY_DATE
+                );''',
+                '''DELETE FROM T_MEMBERS WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM T_MEMBERS GROUP BY USER_ID, GROUP_ID, TODAY_DATE
+                );''',
+                '''DELETE FROM GROUPS WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM GROUPS GROUP BY GROUP_ID, DATA_TIME
+                );''',
+                '''DELETE FROM OBSERVED_GROUPS WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM OBSERVED_GROUPS GROUP BY GROUP_ID
+                );''',
+                'CREATE UNIQUE INDEX IF NOT EXISTS MEMBERS_PK ON MEMBERS (USER_ID, GROUP_ID, TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS MEMBERS_GROUP_DATE ON MEMBERS (GROUP_ID, TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS MEMBERS_DATE ON MEMBERS (TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS MEMBERS_DATA_TIME ON MEMBERS (DATA_TIME);',
+                'CREATE UNIQUE INDEX IF NOT EXISTS T_MEMBERS_PK ON T_MEMBERS (USER_ID, GROUP_ID, TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS T_MEMBERS_GROUP_DATE ON T_MEMBERS (GROUP_ID, TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS T_MEMBERS_DATA_TIME ON T_MEMBERS (DATA_TIME);',
+                'CREATE UNIQUE INDEX IF NOT EXISTS GROUPS_PK ON GROUPS (GROUP_ID, DATA_TIME);',
+                'CREATE UNIQUE INDEX IF NOT EXISTS OBSERVED_GROUPS_PK ON OBSERVED_GROUPS (GROUP_ID);',
+            ],
+            [   # 版本2: 成员快照表，由触发器维护MEMBERS与T_MEMBERS的合并结果，代替查询时的UNION
+                '''CREATE TABLE IF NOT EXISTS L_MEMBERS (                   -- 成员快照表(历史数据与最新数据合并)
+                    USER_ID INTEGER,                    -- 用户ID
+                    NICKNAME TEXT,                      -- 用户昵称
+                    GROUP_NICKNAME TEXT,                -- 班内昵称
+                    COMPLETED_TIME TEXT,                -- 打卡时间
+                    TODAY_DATE TEXT,                    -- 记录日期
+                    WORD_COUNT INTEGER,                 -- 今日词数
+                    STUDY_CHEAT INTEGER,                -- 是否作弊
+                    COMPLETED_TIMES INTEGER,            -- 打卡天数
+                    DURATION_DAYS INTEGER,              -- 入班天数
+                    BOOK_NAME TEXT,                     -- 学习词书
+                    GROUP_ID INTEGER,                   -- 小班ID
+                    GROUP_NAME TEXT,                    -- 小班昵称
+                    AVATAR TEXT,                        -- 用户头像
+                    DATA_TIME TEXT                      -- 采集时间
+                );''',
+                'CREATE UNIQUE INDEX IF NOT EXISTS L_MEMBERS_PK ON L_MEMBERS (USER_ID, GROUP_ID, TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS L_MEMBERS_GROUP_DATE ON L_MEMBERS (GROUP_ID, TODAY_DATE);',
+                'CREATE INDEX IF NOT EXISTS L_MEMBERS_GROUP_DATA_TIME ON L_MEMBERS (GROUP_ID, DATA_TIME DESC);',
+                'INSERT OR IGNORE INTO L_MEMBERS SELECT * FROM MEMBERS;',
+                self.snapshotUpsertSql('SELECT * FROM T_MEMBERS WHERE 1', newer=True),
+                f'''CREATE TRIGGER IF NOT EXISTS MEMBERS_INSERT_SNAPSHOT AFTER INSERT ON MEMBERS BEGIN
+                    {self.snapshotUpsertSql(self.snapshotValuesSql('NEW'), newer=True)}
+                END;''',
+                f'''CREATE TRIGGER IF NOT EXISTS MEMBERS_UPDATE_SNAPSHOT AFTER UPDATE ON MEMBERS BEGIN
+                    {self.snapshotUpsertSql(self.snapshotValuesSql('NEW'), newer=False)}
+                END;''',
+                f'''CREATE TRIGGER IF NOT EXISTS T_MEMBERS_INSERT_SNAPSHOT AFTER INSERT ON T_MEMBERS BEGIN
+                    {self.snapshotUpsertSql(self.snapshotValuesSql('NEW'), newer=True)}
+                END;''',
+                f'''CREATE TRIGGER IF NOT EXISTS T_MEMBERS_UPDATE_SNAPSHOT AFTER UPDATE ON T_MEMBERS BEGIN
+                    {self.snapshotUpsertSql(self.snapshotValuesSql('NEW'), newer=True)}
+                END;''',
+                # 临时数据被清除时，快照回退到正式记录，没有正式记录则一并删除，与原UNION结果保持一致
+                '''CREATE TRIGGER IF NOT EXISTS T_MEMBERS_DELETE_SNAPSHOT AFTER DELETE ON T_MEMBERS BEGIN
+                    DELETE FROM L_MEMBERS
+                    WHERE USER_ID = OLD.USER_ID AND GROUP_ID = OLD.GROUP_ID AND TODAY_DATE = OLD.TODAY_DATE;
+                    INSERT INTO L_MEMBERS SELECT * FROM MEMBERS
+                    WHERE USER_ID = OLD.USER_ID AND GROUP_ID = OLD.GROUP_ID AND TODAY_DATE = OLD.TODAY_DATE;
+                END;''',
+            ],
+            [   # 版本3: 与分页排序一致的索引，供游标分页直接定位
+                'DROP INDEX IF EXISTS L_MEMBERS_GROUP_DATA_TIME;',
+                'CREATE INDEX IF NOT EXISTS L_MEMBERS_PAGE ON L_MEMBERS (GROUP_ID, DATA_TIME DESC, USER_ID DESC);',
+                'CREATE INDEX IF NOT EXISTS MEMBERS_PAGE ON MEMBERS (GROUP_ID, DATA_TIME DESC, USER_ID DESC);',
+            ],
+            # 版本4: 昵称、小班名称的trigram全文索引，SQLite不支持trigram分词时跳过，之后由syncFts在启动时补建
+            self.ftsSql('MEMBERS') + self.ftsSql('L_MEMBERS') if self.fts_supported else [],
+            [   # 版本5: 筛选缓存表，保存用户主页与其在其他小班的打卡情况，跨轮次复用
+                '''CREATE TABLE IF NOT EXISTS FILTER_CACHE (                   -- 筛选缓存表
+                    USER_ID INTEGER,                    -- 用户ID
+                    FIELD TEXT,                         -- 缓存项，profile为个人主页，class{小班ID}为在该小班的打卡情况
+                    VALUE TEXT,                         -- 缓存内容(JSON)
+                    DATA_TIME REAL,                     -- 获取时间戳
+                    PRIMARY KEY (USER_ID, FIELD)
+                );''',
+                'CREATE INDEX IF NOT EXISTS FILTER_CACHE_DATA_TIME ON FILTER_CACHE (DATA_TIME);',
+            ],
+            [   # 版本6: 临时表只更新采集时间时，快照表只同步采集时间，不再整行重写(及重建全文索引)
+                'DROP TRIGGER IF EXISTS T_MEMBERS_UPDATE_SNAPSHOT;',
+                f'''CREATE TRIGGER IF NOT EXISTS T_MEMBERS_UPDATE_SNAPSHOT
+                    AFTER UPDATE OF {", ".join(column for column in self.member_columns if column != 'DATA_TIME')} ON T_MEMBERS BEGIN
+                    {self.snapshotUpsertSql(self.snapshotValuesSql('NEW'), newer=True)}
+                END;''',
+                '''CREATE TRIGGER IF NOT EXISTS T_MEMBERS_UPDATE_DATA_TIME AFTER UPDATE OF DATA_TIME ON T_MEMBERS BEGIN
+                    UPDATE L_MEMBERS SET DATA_TIME = NEW.DATA_TIME
+                    WHERE USER_ID = NEW.USER_ID AND GROUP_ID = NEW.GROUP_ID AND TODAY_DATE = NEW.TODAY_DATE
+                    AND DATA_TIME < NEW.DATA_TIME;
+                END;''',
+            ],
+        ]
         self.init()
 
+    member_columns = [
+        'USER_ID',
+        'NICKNAME',
+        'GROUP_NICKNAME',
+        'COMPLETED_TIME',
+        'TODAY_DATE',
+        'WORD_COUNT',
+        'STUDY_CHEAT',
+        'COMPLETED_TIMES',
+        'DURATION_DAYS',
+        'BOOK_NAME',
+        'GROUP_ID',
+        'GROUP_NAME',
+        'AVATAR',
+        'DATA_TIME',
+    ]
+
+    member_header = [
+        '用户ID',
+        '用户昵称',
+        '班内昵称',
+        '打卡时间',
+        '记录日期',
+        '今日词数',
+        '是否作弊',
+        '打卡天数',
+        '入班天数',
+        '学习词书',
+        '小班ID',
+        '小班名称',
+        '用户头像',
+        '采集时间',
+    ]
+
+    def snapshotValuesSql(self, row: str) -> str:
+        '''生成触发器中引用NEW/OLD整行的VALUES子句'''
+        return f'VALUES ({", ".join(f"{row}.{column}" for column in self.member_columns)})'
+
+    def snapshotUpsertSql(self, source: str, newer: bool = True) -> str:
+        '''生成写入成员快照表L_MEMBERS的UPSERT语句，newer为真时只接受采集时间不早于现有数据的行'''
+        update_columns = [column for column in self.member_columns if column not in ['USER_ID', 'GROUP_ID', 'TODAY_DATE']]
+        sql = f'''INSERT INTO L_MEMBERS {source}
+            ON CONFLICT (USER_ID, GROUP_ID, TODAY_DATE) DO UPDATE SET
+            {", ".join(f"{column} = excluded.{column}" for column in update_columns)}'''
+        if newer:
+            sql += ' WHERE excluded.DATA_TIME >= L_MEMBERS.DATA_TIME'
+        return sql + ';'
+
+    def checkFts(self) -> bool:
+        '''检查当前SQLite是否支持FTS5的trigram分词(3.34.0及以上)'''
+        try:
+            conn = sqlite3.connect(':memory:')
+            conn.execute("CREATE VIRTUAL TABLE FTS_CHECK USING fts5(TEXT, tokenize = 'trigram')")
+            conn.close()
+            return True
+        except sqlite3.Error:
+            logger.warning(f'当前SQLite({sqlite3.sqlite_version})不支持FTS5 trigram分词，模糊搜索将不使用全文索引')
+            return False
+
+    def ftsSql(self, table: str) -> list[str]:
+        '''生成成员表的全文索引及同步触发器
+
+        索引以外部内容表的方式建立，只保存分词结果，通过rowid与原表对应，
+        原表没有INTEGER PRIMARY KEY，VACUUM可能改变rowid，由syncFts在启动时检查并重建索引
+        '''
+        columns = ['USER_ID', 'NICKNAME', 'GROUP_NICKNAME', 'GROUP_NAME']
+        new_values = ', '.join(f'NEW.{column}' for column in columns)
+        old_values = ', '.join(f'OLD.{column}' for column in columns)
+        return [
+            f'''CREATE VIRTUAL TABLE IF NOT EXISTS {table}_FTS USING fts5(
+                {', '.join(columns)}, content = '{table}', content_rowid = 'rowid', tokenize = 'trigram'
+            );''',
+            f'''CREATE TRIGGER IF NOT EXISTS {table}_FTS_INSERT AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_FTS (rowid, {', '.join(columns)}) VALUES (NEW.rowid, {new_values});
+            END;''',
+            f'''CREATE TRIGGER IF NOT EXISTS {table}_FTS_DELETE AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_FTS ({table}_FTS, rowid, {', '.join(columns)}) VALUES ('delete', OLD.rowid, {old_values});
+            END;''',
+            f'''CREATE TRIGGER IF NOT EXISTS {table}_FTS_UPDATE AFTER UPDATE OF {', '.join(columns)} ON {table} BEGIN
+                INSERT INTO {table}_FTS ({table}_FTS, rowid, {', '.join(columns)}) VALUES ('delete', OLD.rowid, {old_values});
+                INSERT INTO {table}_FTS (rowid, {', '.join(columns)}) VALUES (NEW.rowid, {new_values});
+            END;''',
+            f"INSERT INTO {table}_FTS ({table}_FTS) VALUES ('rebuild');",
+        ]
+
     def connect(self, db_path) -> sqlite3.Connection:
-        '''连接数据库，并返回连接态'''
+        '''建立新的数据库连接，由连接池调用，连接归还后可以被其他线程借出'''
         try:
-            if path := os.path.dirname(db_path):
-                os.makedirs(path, exist_ok=True)
-            conn = sqlite3.connect(db_path)
+            conn = sqlite3.connect(db_path, timeout=self.busy_timeout / 1000, cached_statements=256, check_same_thread=False)
+            # WAL模式下读写互不阻塞，网页查询不会被每日记录的写入卡住
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout}')
+            conn.execute(f'PRAGMA cache_size = -{self.cache_size}')
+            conn.execute('PRAGMA temp_store = MEMORY')
             conn.set_trace_callback(lambda statement: logger.debug(f'在{self.db_path}执行SQLite指令: {statement}'))
             return conn
         except sqlite3.Error:
@@ -104,221 +313,394 @@ class SQLite:
             time.sleep(5)
             sys.exit(0)
 
+    @contextmanager
+    def connection(self):
+        '''从连接池借出连接，用完后归还，网页请求每次都在新线程中处理，也能复用已建立的连接'''
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            yield conn # 同一线程内嵌套调用，由最外层负责归还
+            return
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            conn = self.connect(self.db_path)
+        self.local.conn = conn
+        try:
+            yield conn
+        finally:
+            self.local.conn = None
+            if conn.in_transaction:
+                # 操作异常中断时遗留的事务，回滚以释放写锁
+                conn.rollback()
+            try:
+                self.pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
     def init(self) -> None:
         '''初始化不存在的库'''
-        conn = self.connect(self.db_path)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            for sql in self.init_sql:
+                cursor.execute(sql)
+                conn.commit()
+            self.migrate(conn)
+            self.syncFts(conn)
+        self.fts_enabled = self.read("SELECT COUNT(*) FROM sqlite_master WHERE NAME IN ('MEMBERS_FTS', 'L_MEMBERS_FTS')")[0][0] == 2
+
+    def migrate(self, conn: sqlite3.Connection) -> None:
+        '''将数据库迁移到最新版本，每个版本在单独的事务中执行'''
         cursor = conn.cursor()
-        for sql in self.init_sql:
-            cursor.execute(sql)
-            conn.commit()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for target, sql_list in enumerate(self.migrate_sql[version:], start=version + 1):
+            logger.info(f'正在将数据库{self.db_path}由版本{target - 1}迁移至版本{target}')
+            start_time = time.time()
+            try:
+                cursor.execute('BEGIN')
+                for sql in sql_list:
+                    cursor.execute(sql)
+                    if cursor.rowcount > 0 and sql.lstrip().upper().startswith('DELETE'):
+                        logger.info(f'迁移版本{target}清理了{cursor.rowcount}条重复数据')
+                cursor.execute(f'PRAGMA user_version = {target}')
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f'数据库迁移至版本{target}失败: {e}，程序会在5秒后自动退出')
+                time.sleep(5)
+                sys.exit(0)
+            logger.info(f'数据库已迁移至版本{target}，耗时{time.time() - start_time:.2f}秒')
+
+    def syncFts(self, conn: sqlite3.Connection) -> None:
+        '''每次启动时检查全文索引，缺失时补建(例如迁移版本4时SQLite尚不支持trigram)，与原表rowid不一致时重建(例如执行过VACUUM)'''
+        if not self.fts_supported:
+            return
+        cursor = conn.cursor()
+        for table in ['MEMBERS', 'L_MEMBERS']:
+            if cursor.execute('SELECT 1 FROM sqlite_master WHERE NAME = ?', [f'{table}_FTS']).fetchone():
+                # VACUUM只会改变有空缺的rowid，此时rowid的最大值与总和必然变化
+                content = cursor.execute(f'SELECT COUNT(*), MAX(rowid), SUM(rowid) FROM {table}').fetchone()
+                indexed = cursor.execute(f'SELECT COUNT(*), MAX(id), SUM(id) FROM {table}_FTS_docsize').fetchone()
+                if content == indexed:
+                    continue
+                logger.warning(f'{table}的全文索引与原表不一致，正在重建')
+                sql_list = [f"INSERT INTO {table}_FTS ({table}_FTS) VALUES ('rebuild');"]
+            else:
+                logger.info(f'正在为{table}建立全文索引')
+                sql_list = self.ftsSql(table)
+            start_time = time.time()
+            try:
+                cursor.execute('BEGIN')
+                for sql in sql_list:
+                    cursor.execute(sql)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f'建立{table}的全文索引失败: {e}，模糊搜索将不使用全文索引')
+                continue
+            logger.info(f'{table}的全文索引已建立，耗时{time.time() - start_time:.2f}秒')
 
     def read(self, sql: str, param: list | tuple = ()) -> list:
         '''SQL执行读数据操作'''
         try:
-            conn = self.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(sql, param)
-            return cursor.fetchall()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, param)
+                return cursor.fetchall()
         except sqlite3.DatabaseError as e:
             logger.error(f'读取数据库{self.db_path}出错: {e}')
             raise e
 
     def write(self, sql: str, param: list | tuple = ()) -> bool:
         '''SQL执行写数据操作'''
-        try:
-            conn = self.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(sql, param)
-            conn.commit()
-            return True
-        except sqlite3.DatabaseError as e:
-            logger.error(f'写入数据库{self.db_path}出错: {e}')
+        with self.connection() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, param)
+                conn.commit()
+                return True
+            except sqlite3.DatabaseError as e:
+                conn.rollback()
+                logger.error(f'写入数据库{self.db_path}出错: {e}')
         return False
 
-    def saveGroupInfo(self, group_list: list[dict], temp: bool = False) -> None:
-        '''保存小班数据'''
-        if temp:
+    def writeMany(self, sql_list: list[tuple[str, list]]) -> bool:
+        '''SQL批量执行写数据操作，sql_list为[(语句, 参数列表)]，全部在同一事务中提交'''
+        with self.connection() as conn:
+            try:
+                with conn:
+                    for sql, param_list in sql_list:
+                        if param_list:
+                            conn.executemany(sql, param_list)
+                return True
+            except sqlite3.DatabaseError as e:
+                logger.error(f'批量写入数据库{self.db_path}出错: {e}')
+        return False
+
+    def buildUpdateSql(self, table: str, columns: list[tuple[str, str]], keys: list[tuple[str, str]], row: dict) -> tuple[str, list]:
+        '''按字典中非空的字段生成UPDATE语句，字段相同的行生成的语句相同，可复用同一预编译语句批量执行'''
+        fields = [(column, row[key]) for key, column in columns if row.get(key) is not None]
+        if not fields:
+            return '', []
+        sql = f'UPDATE {table} SET {", ".join(f"{column} = ?" for column, _ in fields)}'
+        sql += f' WHERE {" AND ".join(f"{column} = ?" for _, column in keys)}'
+        return sql, [value for _, value in fields] + [row[key] for key, _ in keys]
+
+    def updateMany(self, table: str, columns: list[tuple[str, str]], keys: list[tuple[str, str]], row_list: list[dict]) -> bool:
+        '''按更新字段分组后批量执行UPDATE'''
+        batch = {}
+        for row in row_list:
+            sql, params = self.buildUpdateSql(table, columns, keys, row)
+            if sql:
+                batch.setdefault(sql, []).append(params)
+        return self.writeMany(list(batch.items()))
+
+    def toGroupRow(self, group_info: dict) -> tuple:
+        '''小班字典转换为GROUPS表的一行'''
+        return (
+            group_info['id'],
+            group_info['name'],
+            group_info['share_key'],
+            group_info['introduction'],
+            group_info['leader'],
+            group_info['leader_id'],
+            group_info['member_count'],
+            group_info['count_limit'],
+            group_info['today_daka_count'],
+            group_info['finishing_rate'],
+            group_info['created_time'],
+            group_info['rank'],
+            group_info['type'],
+            group_info['avatar'],
+            group_info['avatar_frame'],
+            group_info['data_time'],
+        )
+
+    def toMemberRow(self, member: dict) -> tuple:
+        '''成员字典转换为MEMBERS表的一行'''
+        return (
+            member['id'],
+            member['nickname'],
+            member['group_nickname'],
+            member['completed_time'],
+            member['today_date'],
+            member['today_word_count'],
+            member['today_study_cheat'],
+            member['completed_times'],
+            member['duration_days'],
+            member['book_name'],
+            member['group_id'],
+            member['group_name'],
+            member['avatar'],
+            member['data_time'],
+        )
+
+    def saveGroupInfo(self, group_list: list[dict], temp: bool = False) -> bool:
+        '''保存小班数据，同一批次在一个事务中写入'''
+        group_list = [group_info for group_info in group_list if not group_info.get('exception')]
+        member_table = 'T_MEMBERS' if temp else 'MEMBERS'
+        member_rows = [self.toMemberRow(member) for group_info in group_list for member in group_info['members']]
+        sql_list = [(f'INSERT OR IGNORE INTO {member_table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', member_rows)]
+        if not temp:
+            group_rows = [self.toGroupRow(group_info) for group_info in group_list]
+            sql_list.insert(0, ('INSERT OR IGNORE INTO GROUPS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', group_rows))
+        return self.writeMany(sql_list)
+
+    def saveTempGroupInfo(self, group_list: list[dict]) -> dict:
+        '''增量保存成员临时表，只写入内容有变化的成员并删除已退出小班或非当天的记录，返回各类写入的行数
+
+        成员内容的哈希不包含采集时间，未变化的成员只按小班批量更新DATA_TIME，保证采集时间与最近一次刷新一致
+        '''
+        group_list = [group_info for group_info in group_list if not group_info.get('exception')]
+        update_columns = [column for column in self.member_columns if column not in ['USER_ID', 'GROUP_ID', 'TODAY_DATE']]
+        upsert_sql = f'''INSERT INTO T_MEMBERS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (USER_ID, GROUP_ID, TODAY_DATE) DO UPDATE SET
+            {", ".join(f"{column} = excluded.{column}" for column in update_columns)}'''
+        with self.snapshot_lock:
+            reset_rows = []
+            delete_rows = []
+            upsert_rows = []
+            touch_rows = []
+            member_hash = {}
+            data_time = {}
             for group_info in group_list:
-                if group_info.get('exception'):
-                    continue
-                self.saveMemberInfo(group_info['members'], temp)
-            return
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
-        for group_info in group_list:
-            if group_info.get('exception'):
-                continue
-            cursor.execute(
-                f'INSERT OR IGNORE INTO GROUPS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                (
-                    group_info['id'],
-                    group_info['name'],
-                    group_info['share_key'],
-                    group_info['introduction'],
-                    group_info['leader'],
-                    group_info['leader_id'],
-                    group_info['member_count'],
-                    group_info['count_limit'],
-                    group_info['today_daka_count'],
-                    group_info['finishing_rate'],
-                    group_info['created_time'],
-                    group_info['rank'],
-                    group_info['type'],
-                    group_info['avatar'],
-                    group_info['avatar_frame'],
-                    group_info['data_time'],
-                )
-            )
-            conn.commit()
-            self.saveMemberInfo(group_info['members'])
+                last = self.member_hash.get(group_info['id'])
+                current = {}
+                for member in group_info['members']:
+                    row = self.toMemberRow(member)
+                    current[member['id']] = (member['today_date'], hash(row[:-1]))
+                    if last is None or last.get(member['id']) != current[member['id']]:
+                        upsert_rows.append(row)
+                if last is None:
+                    # 启动后首次刷新该小班时不知道临时表中已有哪些成员，整体重写一次
+                    reset_rows.append((group_info['id'],))
+                else:
+                    for user_id, (today_date, _) in last.items():
+                        if user_id not in current or current[user_id][0] != today_date:
+                            delete_rows.append((user_id, group_info['id'], today_date))
+                member_hash[group_info['id']] = current
+                if group_info['members']:
+                    data_time[group_info['id']] = group_info['members'][0]['data_time']
+                    touch_rows.append((data_time[group_info['id']], group_info['id'], data_time[group_info['id']]))
+            if not self.writeMany([
+                ('DELETE FROM T_MEMBERS WHERE GROUP_ID = ?', reset_rows),
+                ('DELETE FROM T_MEMBERS WHERE USER_ID = ? AND GROUP_ID = ? AND TODAY_DATE = ?', delete_rows),
+                (upsert_sql, upsert_rows),
+                ('UPDATE T_MEMBERS SET DATA_TIME = ? WHERE GROUP_ID = ? AND DATA_TIME < ?', touch_rows),
+            ]):
+                # 写入失败时丢弃这些小班的记录，下次刷新整体重写
+                for group_id in member_hash:
+                    self.member_hash.pop(group_id, None)
+                    self.temp_data_time.pop(group_id, None)
+                return {}
+            self.member_hash.update(member_hash)
+            refresh_time = int(time.time())
+            for group_id in member_hash:
+                if group_id in data_time:
+                    self.temp_data_time[group_id] = int(datetime.strptime(data_time[group_id], '%Y-%m-%d %H:%M:%S').timestamp())
+                else:
+                    self.temp_data_time[group_id] = refresh_time
+        result = {
+            'total': sum(len(current) for current in member_hash.values()),
+            'upsert': len(upsert_rows),
+            'delete': len(delete_rows),
+        }
+        logger.debug(f'成员临时表增量刷新: {result}')
+        return result
 
-    def saveMemberInfo(self, members: list, temp: bool = False) -> None:
+    def saveMemberInfo(self, members: list, temp: bool = False) -> bool:
         '''仅保存成员详情'''
         table_name = 'MEMBERS'
         if temp:
             table_name = 'T_' + table_name
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
-        for member in members:
-            cursor.execute(
-                f'INSERT OR IGNORE INTO {table_name} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                (
-                    member['id'],
-                    member['nickname'],
-                    member['group_nickname'],
-                    member['completed_time'],
-                    member['today_date'],
-                    member['today_word_count'],
-                    member['today_study_cheat'],
-                    member['completed_times'],
-                    member['duration_days'],
-                    member['book_name'],
-                    member['group_id'],
-                    member['group_name'],
-                    member['avatar'],
-                    member['data_time'],
-                )
-            )
-        conn.commit()
+        return self.writeMany([(
+            f'INSERT OR IGNORE INTO {table_name} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [self.toMemberRow(member) for member in members],
+        )])
 
-    def addObserveGroupInfo(self, group_list: list[dict]) -> None:
+    def addObserveGroupInfo(self, group_list: list[dict]) -> bool:
         '''增加关注小班信息'''
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
-        for group_info in group_list:
-            cursor.execute('DELETE FROM OBSERVED_GROUPS WHERE GROUP_ID = ?', [group_info.get('id', 0)])
-            cursor.execute(
-                '''
-                    INSERT OR REPLACE INTO OBSERVED_GROUPS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''',
-                (
-                    group_info.get('id', 0),
-                    group_info.get('name', ''),
-                    group_info.get('share_key', ''),
-                    group_info.get('introduction', ''),
-                    group_info.get('leader', ''),
-                    group_info.get('leader_id', ''),
-                    group_info.get('member_count', 0),
-                    group_info.get('count_limit', 0),
-                    group_info.get('today_daka_count', 0),
-                    group_info.get('finishing_rate', 0),
-                    group_info.get('created_time', ''),
-                    group_info.get('rank', 1),
-                    group_info.get('type', 0),
-                    group_info.get('avatar', ''),
-                    group_info.get('avatar_frame', ''),
-                    group_info.get('notice', ''),
-                    group_info.get('daily_record', 1),
-                    group_info.get('late_daka_time', ''),
-                    group_info.get('auth_token', ''),
-                    group_info.get('valid', 1),
-                )
+        rows = [
+            (
+                group_info.get('id', 0),
+                group_info.get('name', ''),
+                group_info.get('share_key', ''),
+                group_info.get('introduction', ''),
+                group_info.get('leader', ''),
+                group_info.get('leader_id', ''),
+                group_info.get('member_count', 0),
+                group_info.get('count_limit', 0),
+                group_info.get('today_daka_count', 0),
+                group_info.get('finishing_rate', 0),
+                group_info.get('created_time', ''),
+                group_info.get('rank', 1),
+                group_info.get('type', 0),
+                group_info.get('avatar', ''),
+                group_info.get('avatar_frame', ''),
+                group_info.get('notice', ''),
+                group_info.get('daily_record', 1),
+                group_info.get('late_daka_time', ''),
+                group_info.get('auth_token', ''),
+                group_info.get('valid', 1),
             )
-        conn.commit()
+            for group_info in group_list
+        ]
+        result = self.writeMany([
+            ('DELETE FROM OBSERVED_GROUPS WHERE GROUP_ID = ?', [(row[0],) for row in rows]),
+            ('INSERT OR REPLACE INTO OBSERVED_GROUPS VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows),
+        ])
+        self.invalidateObserveGroupInfo()
+        return result
 
-    def disableObserveGroupInfo(self, group_id) -> None:
+    def disableObserveGroupInfo(self, group_id) -> bool:
         '''禁用关注小班'''
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        result = self.write(
             'UPDATE OBSERVED_GROUPS SET VALID=0 WHERE GROUP_ID = ?',
-            (group_id)
+            (group_id,)
         )
-        conn.commit()
+        self.invalidateObserveGroupInfo()
+        return result
 
-    def updateObserveGroupInfo(self, group_list: list[dict]) -> None:
-        '''更新关注小班信息'''
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
+    def updateObserveGroupInfo(self, group_list: list[dict], changed_only: bool = False, local: bool = True) -> bool:
+        '''更新关注小班信息，changed_only为真时跳过接口数据与上次写入相同的小班
+
+        local为假时只写入从接口获取的列，刷新期间网页对关注设置的修改不会被刷新前读到的旧值覆盖
+        '''
+        columns = [
+            ('name', 'NAME'),
+            ('share_key', 'SHARE_KEY'),
+            ('introduction', 'INTRO'),
+            ('leader', 'LEADER'),
+            ('leader_id', 'LEADER_ID'),
+            ('member_count', 'MEMBER_COUNT'),
+            ('count_limit', 'COUNT_LIMIT'),
+            ('today_daka_count', 'TODAY_DAKA'),
+            ('finishing_rate', 'FINISHING_RATE'),
+            ('created_time', 'CREATED_TIME'),
+            ('rank', 'RANK'),
+            ('type', 'GROUP_TYPE'),
+            ('avatar', 'AVATAR'),
+            ('avatar_frame', 'AVATAR_FRAME'),
+            ('notice', 'NOTICE'),
+        ]
+        # 哈希只包含从接口获取的列，两种写入方式都会更新
+        group_hash = {group_info['id']: hash(tuple(group_info.get(key) for key, _ in columns)) for group_info in group_list}
+        if local:
+            columns += [
+                ('daily_record', 'DAILY_RECORD'),
+                ('late_daka_time', 'LATE_DAKA_TIME'),
+                ('auth_token', 'AUTH_TOKEN'),
+                ('valid', 'VALID'),
+            ]
+        if changed_only:
+            group_list = [group_info for group_info in group_list if self.group_hash.get(group_info['id']) != group_hash[group_info['id']]]
+        if not group_list:
+            return True
+        result = self.updateMany('OBSERVED_GROUPS', columns, [('id', 'GROUP_ID')], group_list)
+        self.invalidateObserveGroupInfo()
+        if not result:
+            return False
         for group_info in group_list:
-            sql = f'UPDATE OBSERVED_GROUPS SET'
-            params = []
-            # if group_info.get('id') != None: sql += ' GROUP_ID = ?,'; params.append(group_info.get('id'))
-            if group_info.get('name') != None: sql += ' NAME = ?,'; params.append(group_info.get('name'))
-            if group_info.get('share_key') != None: sql += ' SHARE_KEY = ?,'; params.append(group_info.get('share_key'))
-            if group_info.get('introduction') != None: sql += ' INTRO = ?,'; params.append(group_info.get('introduction'))
-            if group_info.get('leader') != None: sql += ' LEADER = ?,'; params.append(group_info.get('leader'))
-            if group_info.get('leader_id') != None: sql += ' LEADER_ID = ?,'; params.append(group_info.get('leader_id'))
-            if group_info.get('member_count') != None: sql += ' MEMBER_COUNT = ?,'; params.append(group_info.get('member_count'))
-            if group_info.get('count_limit') != None: sql += ' COUNT_LIMIT = ?,'; params.append(group_info.get('count_limit'))
-            if group_info.get('today_daka_count') != None: sql += ' TODAY_DAKA = ?,'; params.append(group_info.get('today_daka_count'))
-            if group_info.get('finishing_rate') != None: sql += ' FINISHING_RATE = ?,'; params.append(group_info.get('finishing_rate'))
-            if group_info.get('created_time') != None: sql += ' CREATED_TIME = ?,'; params.append(group_info.get('created_time'))
-            if group_info.get('rank') != None: sql += ' RANK = ?,'; params.append(group_info.get('rank'))
-            if group_info.get('type') != None: sql += ' GROUP_TYPE = ?,'; params.append(group_info.get('type'))
-            if group_info.get('avatar') != None: sql += ' AVATAR = ?,'; params.append(group_info.get('avatar'))
-            if group_info.get('avatar_frame') != None: sql += ' AVATAR_FRAME = ?,'; params.append(group_info.get('avatar_frame'))
-            if group_info.get('notice') != None: sql += ' NOTICE = ?,'; params.append(group_info.get('notice'))
-            if group_info.get('daily_record') != None: sql += ' DAILY_RECORD = ?,'; params.append(group_info.get('daily_record'))
-            if group_info.get('late_daka_time') != None: sql += ' LATE_DAKA_TIME = ?,'; params.append(group_info.get('late_daka_time'))
-            if group_info.get('auth_token') != None: sql += ' AUTH_TOKEN = ?,'; params.append(group_info.get('auth_token'))
-            if group_info.get('valid') != None: sql += ' VALID = ?,'; params.append(group_info.get('valid'))
-            sql = sql.strip(',')
-            sql += ' WHERE GROUP_ID = ?'
-            params.append(group_info['id'])
-            cursor.execute(sql, params)
-        conn.commit()
-
-    def updateMemberInfo(self, member_list: list[dict]) -> None:
-        '''更新关注小班信息'''
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
-        for member in member_list:
-            sql = f'UPDATE MEMBERS SET'
-            params = []
-            # if group_info.get('id') != None: sql += ' USER_ID = ?,'; params.append(group_info.get('id'))
-            if member.get('nickname') != None: sql += ' NICKNAME = ?,'; params.append(member.get('nickname'))
-            if member.get('group_nickname') != None: sql += ' GROUP_NICKNAME = ?,'; params.append(member.get('group_nickname'))
-            if member.get('completed_time') != None: sql += ' COMPLETED_TIME = ?,'; params.append(member.get('completed_time'))
-            # if member.get('today_date') != None: sql += ' TODAY_DATE = ?,'; params.append(member.get('today_date'))
-            if member.get('today_word_count') != None: sql += ' WORD_COUNT = ?,'; params.append(member.get('today_word_count'))
-            if member.get('today_study_cheat') != None: sql += ' STUDY_CHEAT = ?,'; params.append(member.get('today_study_cheat'))
-            if member.get('completed_times') != None: sql += ' COMPLETED_TIMES = ?,'; params.append(member.get('completed_times'))
-            if member.get('duration_days') != None: sql += ' DURATION_DAYS = ?,'; params.append(member.get('duration_days'))
-            if member.get('book_name') != None: sql += ' BOOK_NAME = ?,'; params.append(member.get('book_name'))
-            # if member.get('group_id') != None: sql += ' GROUP_ID = ?,'; params.append(member.get('group_id'))
-            if member.get('group_name') != None: sql += ' GROUP_NAME = ?,'; params.append(member.get('group_name'))
-            if member.get('avatar') != None: sql += ' AVATAR = ?,'; params.append(member.get('avatar'))
-            if member.get('data_time') != None: sql += ' DATA_TIME = ?,'; params.append(member.get('data_time'))
-            sql = sql.strip(',')
-            sql += ' WHERE USER_ID = ? AND TODAY_DATE = ? AND GROUP_ID = ?'
-            params.append(member['id'])
-            params.append(member['today_date'])
-            params.append(member['group_id'])
-            cursor.execute(sql, params)
-        conn.commit()
-
-    def queryObserveGroupInfo(self, group_id: str = '', all: bool = False) -> dict:
-        '''查询关注小班信息'''
-        sql = f'SELECT * FROM OBSERVED_GROUPS WHERE 1 = 1'
-        params = []
-        if not all:
-            sql += ' AND VALID = 1'
-        if group_id:
-            sql += ' AND GROUP_ID = ?'
-            params.append(group_id)
-        sql += ' ORDER BY GROUP_ID ASC'
-        result = self.read(sql, params)
+            self.group_hash[group_info['id']] = group_hash[group_info['id']]
+        return True
+
+    def updateMemberInfo(self, member_list: list[dict]) -> bool:
+        '''更新成员记录，以(用户ID, 记录日期, 小班ID)定位'''
+        columns = [
+            ('nickname', 'NICKNAME'),
+            ('group_nickname', 'GROUP_NICKNAME'),
+            ('completed_time', 'COMPLETED_TIME'),
+            ('today_word_count', 'WORD_COUNT'),
+            ('today_study_cheat', 'STUDY_CHEAT'),
+            ('completed_times', 'COMPLETED_TIMES'),
+            ('duration_days', 'DURATION_DAYS'),
+            ('book_name', 'BOOK_NAME'),
+            ('group_name', 'GROUP_NAME'),
+            ('avatar', 'AVATAR'),
+            ('data_time', 'DATA_TIME'),
+        ]
+        keys = [('id', 'USER_ID'), ('today_date', 'TODAY_DATE'), ('group_id', 'GROUP_ID')]
+        return self.updateMany('MEMBERS', columns, keys, member_list)
+
+    def queryObserveGroupInfo(self, group_id: str = '', all: bool = False) -> list[dict]:
+        '''查询关注小班信息，整表缓存cache_second秒，每次返回新的字典，调用方可以随意修改'''
+        now = time.time()
+        with self.observe_lock:
+            if self.observe_cache and now - self.observe_cache[0] < self.cache_second:
+                self.observe_cache_hit += 1
+                group_list = self.observe_cache[1]
+            else:
+                self.observe_cache_miss += 1
+                group_list = self.readObserveGroupInfo()
+                self.observe_cache = (now, group_list)
+        return [
+            {**group, 'members': []}
+            for group in group_list
+            if (all or group['valid'] == 1) and (not group_id or str(group['id']) == str(group_id))
+        ]
+
+    def readObserveGroupInfo(self) -> list[dict]:
+        '''从数据库读取全部关注小班信息，仅内部调用'''
+        result = self.read('SELECT * FROM OBSERVED_GROUPS ORDER BY GROUP_ID ASC')
         result_keys = [
             'id',
             'name',
@@ -341,12 +723,12 @@ class SQLite:
             'auth_token',
             'valid',
         ]
-        group_info = []
-        for item in result:
-            group_info.append(dict(zip(result_keys, item)))
-        for group in group_info:
-            group['members'] = []
-        return group_info
+        return [dict(zip(result_keys, item)) for item in result]
+
+    def invalidateObserveGroupInfo(self) -> None:
+        '''关注小班表被修改后清除缓存'''
+        with self.observe_lock:
+            self.observe_cache = None
 
     def getDays(self) -> int:
         '''获取数据记录总天数'''
@@ -369,6 +751,10 @@ class SQLite:
             'count': self.getMemberDataCount(),
             'running_days': self.getDays(),
             'groups': groups,
+            'observe_cache': {
+                'hit': self.observe_cache_hit,
+                'miss': self.observe_cache_miss,
+            },
         }
 
     def getGroupInfo(self) -> dict:
@@ -437,7 +823,7 @@ class SQLite:
     def getMemberDataCount(self, union_temp: bool = True) -> int:
         if union_temp:
             return self.read(
-                f'SELECT COUNT(*) FROM (SELECT * FROM MEMBERS UNION SELECT * FROM T_MEMBERS)'
+                f'SELECT COUNT(*) FROM L_MEMBERS'
             )[0][0]
         else:
             return self.read(
@@ -460,13 +846,76 @@ class SQLite:
                 'completed_time': 打卡时间
                 'user_id': 用户ID
                 'nickname': 用户昵称
+                'cursor': 分页游标，存在该键时使用游标分页，首页传空字符串，之后传上次返回的next_cursor
+                'count_mode': 为cached时总数使用缓存结果
             }
             header (str): 是否添加表头
-            temp (str): 是否临时表
+            union_temp (bool): 是否合并临时表中的最新数据
 
         Returns:
             list: 用户信息表
         '''   
+        count_sql, search_sql, sql, param = self.buildMemberQuery(payload, union_temp)
+        count_sql += sql
+        if payload.get('count_mode', '') == 'cached':
+            count = self.readCachedCount(count_sql, param)
+        else:
+            count = self.read(count_sql, param)[0][0]
+        order_sql = ' ORDER BY GROUP_ID ASC, DATA_TIME DESC, USER_ID DESC'
+        page_max = 1
+        page_num = 1
+        page_count = 'unlimited'
+        next_cursor = ''
+        if payload.get('page_count', '') == 'unlimited':
+            result = self.read(search_sql + sql + order_sql, param)
+        else:
+            page_count = payload.get('page_count', 20)
+            page_num = payload.get('page_num', 1)
+            page_num = page_num if page_num else 1
+            page_count = int(page_count) if int(page_count) > 0 else 20
+            page_max = math.ceil(int(count) / page_count)
+            page_num = int(page_num) if int(page_num) > 0 else 1
+            if 'cursor' in payload:
+                # 游标分页：从上一页最后一行之后按索引顺序继续读取，耗时与页数深度无关
+                result = self.readPageByCursor(search_sql + sql, param, order_sql, payload['cursor'], page_count + 1)
+            else:
+                page_num = page_num if page_num < page_max else page_max
+                result = self.read(
+                    search_sql + sql + order_sql + ' LIMIT ? OFFSET (? - 1) * ?',
+                    param + [page_count + 1, max(page_num, 1), page_count],
+                )
+            if len(result) > page_count:
+                result = result[:page_count]
+                next_cursor = self.encodeCursor(result[-1])
+        keys = [
+            'id',
+            'nickname',
+            'group_nickname',
+            'completed_time',
+            'today_date',
+            'today_word_count',
+            'today_study_cheat',
+            'completed_times',
+            'duration_days',
+            'book_name',
+            'group_id',
+            'group_name',
+            'avatar',
+            'data_time',
+        ]
+        if header:
+            result = [self.member_header] + result
+        return {
+            'data': result,
+            'count': count,
+            'page_max': page_max,
+            'page_num': page_num,
+            'page_count': page_count,
+            'next_cursor': next_cursor,
+        }
+
+    def buildMemberQuery(self, payload: dict, union_temp: bool = False) -> tuple[str, str, str, list]:
+        '''根据查询条件生成用户信息表的计数语句、查询语句、条件子句与参数'''
         count_sql = f'SELECT COUNT(*) FROM MEMBERS WHERE 1=1'
         search_sql = f'''
             SELECT
@@ -486,9 +935,12 @@ class SQLite:
                 DATA_TIME
             FROM MEMBERS WHERE 1=1
         '''
-        if union_temp:  
-            count_sql = f'SELECT COUNT(*) FROM (SELECT * FROM MEMBERS UNION SELECT * FROM T_MEMBERS) WHERE 1=1'
-            search_sql = f'SELECT * FROM (SELECT * FROM MEMBERS UNION SELECT * FROM T_MEMBERS) WHERE 1=1'
+        table = 'MEMBERS'
+        if union_temp:
+            # 成员快照表由触发器维护，等价于MEMBERS与T_MEMBERS的合并，且同一天同一成员只保留最新一条
+            table = 'L_MEMBERS'
+            count_sql = count_sql.replace('FROM MEMBERS', 'FROM L_MEMBERS')
+            search_sql = search_sql.replace('FROM MEMBERS', 'FROM L_MEMBERS')
         sql = ''
         param = []
         user_id = payload.get('user_id', '')
@@ -499,19 +951,33 @@ class SQLite:
         edate = payload.get('edate', '')
         cheat = payload.get('cheat', '')
         completed_time = payload.get('completed_time', '')
+        # 三个字符及以上的模糊搜索通过trigram全文索引查找，更短的无法分词，仍使用LIKE
+        match_list = []
         if user_id != '':
-            sql += ' AND USER_ID LIKE ?'
-            param.append(f'%{user_id}%')
+            if self.fts_enabled and len(str(user_id)) >= 3:
+                match_list.append(f'USER_ID : {self.ftsPhrase(user_id)}')
+            else:
+                sql += ' AND USER_ID LIKE ?'
+                param.append(f'%{user_id}%')
         if nickname != '':
-            sql += ' AND (NICKNAME LIKE ? OR GROUP_NICKNAME LIKE ?)'
-            param.append(f'%{nickname}%')
-            param.append(f'%{nickname}%')
+            if self.fts_enabled and len(nickname) >= 3:
+                match_list.append(f'{{NICKNAME GROUP_NICKNAME}} : {self.ftsPhrase(nickname)}')
+            else:
+                sql += ' AND (NICKNAME LIKE ? OR GROUP_NICKNAME LIKE ?)'
+                param.append(f'%{nickname}%')
+                param.append(f'%{nickname}%')
         if group_id != '':
             sql += ' AND GROUP_ID = ?'
             param.append(group_id)
         if group_name != '':
-            sql += ' AND GROUP_NAME LIKE ?'
-            param.append(f'%{group_name}%')
+            if self.fts_enabled and len(group_name) >= 3:
+                match_list.append(f'GROUP_NAME : {self.ftsPhrase(group_name)}')
+            else:
+                sql += ' AND GROUP_NAME LIKE ?'
+                param.append(f'%{group_name}%')
+        if match_list:
+            sql += f' AND rowid IN (SELECT rowid FROM {table}_FTS WHERE {table}_FTS MATCH ?)'
+            param.append(' AND '.join(match_list))
         if sdate != '' or edate != '':
             sdate = sdate if sdate else '0000-00-00'
             edate = edate if edate else '9999-12-31'
@@ -524,35 +990,52 @@ class SQLite:
         if completed_time != '':
             sql += ' AND (COMPLETED_TIME = \'\' OR COMPLETED_TIME > ?)'
             param.append(completed_time)
-        count_sql += sql
-        count_result = self.read(count_sql, param)
-        count = count_result[0][0]
-        sql += ' ORDER BY GROUP_ID ASC, DATA_TIME DESC'
-        page_max = 1
-        page_num = 1
-        page_count = 'unlimited'
-        if payload.get('page_count', '') != 'unlimited':
-            page_count = payload.get('page_count', 20)
-            page_num = payload.get('page_num', 1)
-            page_num = page_num if page_num else 1
-            page_count = page_count if int(page_count) > 0 else 20
-            page_max = math.ceil(int(count) / int(page_count))
-            page_num = page_num if int(page_num) > 0 else 1
-            page_num = page_num if int(page_num) < page_max else page_max
-            sql += ' LIMIT ? OFFSET (? - 1) * ?'
-            param.append(page_count)
-            param.append(page_num)
-            param.append(page_count)
-        search_sql += sql
-        result = self.read(search_sql, param)
+        return count_sql, search_sql, sql, param
+
+    def queryAbsenceMember(self, group_id: str, sdate: str) -> list[tuple]:
+        '''获取小班自指定日期以来缺卡的记录 [(用户ID, 记录日期)]'''
+        return self.read(
+            'SELECT USER_ID, TODAY_DATE FROM MEMBERS WHERE GROUP_ID = ? AND TODAY_DATE >= ? AND COMPLETED_TIME = \'\'',
+            [group_id, sdate],
+        )
+
+    def queryWeekSummary(self, group_id: str, sdate: str, edate: str, today_date: str, late_daka_time: str = '') -> dict:
+        '''在数据库中按成员汇总小班一周的打卡情况，今天的记录不计入统计
+
+        Returns:
+            dict: {
+                'members': [{成员最新一条记录的信息, 'times': 打卡天数, 'late': 迟到天数, 'absence': 缺卡天数}]，按最新记录时间倒序
+                'daka': {成员ID: {日期: {'time': 打卡时间, 'count': 单词数}}}
+            }
+        '''
+        # 聚合函数为MAX时SQLite返回最大值所在行的其他列，即成员最新一条记录的信息
+        summary = self.read(
+            '''
+                SELECT
+                    USER_ID,
+                    NICKNAME,
+                    GROUP_NICKNAME,
+                    COMPLETED_TIMES,
+                    DURATION_DAYS,
+                    BOOK_NAME,
+                    GROUP_ID,
+                    GROUP_NAME,
+                    AVATAR,
+                    MAX(DATA_TIME),
+                    SUM(TODAY_DATE != ? AND COMPLETED_TIME != ''),
+                    SUM(TODAY_DATE != ? AND ? != '' AND COMPLETED_TIME > ?),
+                    SUM(TODAY_DATE != ? AND COMPLETED_TIME = '')
+                FROM MEMBERS
+                WHERE GROUP_ID = ? AND TODAY_DATE BETWEEN ? AND ?
+                GROUP BY USER_ID
+                ORDER BY MAX(DATA_TIME) DESC, USER_ID DESC
+            ''',
+            [today_date, today_date, late_daka_time, late_daka_time, today_date, group_id, sdate, edate],
+        )
         keys = [
             'id',
             'nickname',
             'group_nickname',
-            'completed_time',
-            'today_date',
-            'today_word_count',
-            'today_study_cheat',
             'completed_times',
             'duration_days',
             'book_name',
@@ -560,50 +1043,150 @@ class SQLite:
             'group_name',
             'avatar',
             'data_time',
+            'times',
+            'late',
+            'absence',
         ]
-        if header:
-            result = [[
-                '用户ID',
-                '用户昵称',
-                '班内昵称',
-                '打卡时间',
-                '记录日期',
-                '今日词数',
-                '是否作弊',
-                '打卡天数',
-                '入班天数',
-                '学习词书',
-                '小班ID',
-                '小班名称',
-                '用户头像',
-                '采集时间',
-            ]] + result
+        daka_dict = {}
+        for user_id, daka_date, completed_time, word_count in self.read(
+            '''
+                SELECT USER_ID, TODAY_DATE, COMPLETED_TIME, WORD_COUNT
+                FROM MEMBERS
+                WHERE GROUP_ID = ? AND TODAY_DATE BETWEEN ? AND ? AND TODAY_DATE != ?
+            ''',
+            [group_id, sdate, edate, today_date],
+        ):
+            daka_dict.setdefault(user_id, {})[daka_date] = {
+                'time': completed_time,
+                'count': word_count,
+            }
         return {
-            'data': result,
-            'count': count,
-            'page_max': page_max,
-            'page_num': page_num,
-            'page_count': page_count,
+            'members': [dict(zip(keys, row)) for row in summary],
+            'daka': daka_dict,
         }
 
-    def queryTempMemberCacheTime(self) -> list:
-        '''获取成员临时表的最新缓存数据时间'''
-        result = self.read(
-            f'SELECT DATA_TIME FROM T_MEMBERS ORDER BY DATA_TIME DESC LIMIT 1'
+    def countMemberTable(self, payload: dict, union_temp: bool = False) -> int:
+        '''获取符合查询条件的用户信息表行数'''
+        count_sql, _, sql, param = self.buildMemberQuery(payload, union_temp)
+        return self.read(count_sql + sql, param)[0][0]
+
+    def iterMemberTable(self, payload: dict, header: bool = True, union_temp: bool = False, batch: int = 1000):
+        '''按查询条件逐批读取用户信息表，不分页，内存占用与结果行数无关'''
+        _, search_sql, sql, param = self.buildMemberQuery(payload, union_temp)
+        if header:
+            yield self.member_header
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(search_sql + sql + ' ORDER BY GROUP_ID ASC, DATA_TIME DESC, USER_ID DESC', param)
+                while rows := cursor.fetchmany(batch):
+                    yield from rows
+            except sqlite3.DatabaseError as e:
+                logger.error(f'读取数据库{self.db_path}出错: {e}')
+                raise e
+            finally:
+                cursor.close()
+
+    def ftsPhrase(self, text: str) -> str:
+        '''将搜索内容转义为FTS5短语，trigram分词下短语即子串匹配'''
+        text = str(text).replace('"', '""')
+        return f'"{text}"'
+
+    def encodeCursor(self, row: tuple) -> str:
+        '''将一行数据的排序键(GROUP_ID, DATA_TIME, USER_ID)编码为不透明的游标'''
+        key = json.dumps([row[10], row[13], row[0]], ensure_ascii=False)
+        return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+    def decodeCursor(self, cursor: str) -> list:
+        '''解码游标，返回[GROUP_ID, DATA_TIME, USER_ID]'''
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            if len(key) != 3:
+                raise ValueError(key)
+            return key
+        except Exception:
+            raise ValueError(f'无效的分页游标: {cursor}')
+
+    def readPageByCursor(self, sql: str, param: list, order_sql: str, cursor: str, limit: int) -> list:
+        '''按游标读取一页数据
+
+        排序为GROUP_ID升序、DATA_TIME与USER_ID降序，方向不一致无法用单个行值比较，
+        因此拆为"同一小班内游标之后"与"之后的小班"两段，两段都能直接定位到索引位置
+        '''
+        if not cursor:
+            return self.read(sql + order_sql + ' LIMIT ?', param + [limit])
+        group_id, data_time, user_id = self.decodeCursor(cursor)
+        same_group_sql = f'''SELECT * FROM ({sql} AND GROUP_ID = ? AND DATA_TIME <= ?
+            AND (DATA_TIME < ? OR USER_ID < ?){order_sql} LIMIT ?)'''
+        next_group_sql = f'SELECT * FROM ({sql} AND GROUP_ID > ?{order_sql} LIMIT ?)'
+        return self.read(
+            f'{same_group_sql} UNION ALL {next_group_sql}{order_sql} LIMIT ?',
+            param + [group_id, data_time, data_time, user_id, limit] + param + [group_id, limit, limit],
         )
+
+    def readCachedCount(self, sql: str, param: list) -> int:
+        '''读取计数，相同条件的结果缓存cache_second秒，用于翻页时避免重复COUNT'''
+        key = (sql, tuple(param))
+        now = time.time()
+        with self.count_lock:
+            cached = self.count_cache.get(key)
+            if cached and now - cached[1] < self.cache_second:
+                return cached[0]
+        count = self.read(sql, param)[0][0]
+        with self.count_lock:
+            if len(self.count_cache) > 256:
+                self.count_cache.clear()
+            self.count_cache[key] = (count, now)
+        return count
+
+    def queryTempMemberCacheTime(self, group_id: str = '') -> int:
+        '''获取成员临时表中小班的最新缓存数据时间，不指定小班时返回所有小班中最新的时间'''
+        if group_id:
+            if int(group_id) in self.temp_data_time:
+                return self.temp_data_time[int(group_id)]
+        elif self.temp_data_time:
+            return max(self.temp_data_time.values())
+        sql = 'SELECT MAX(DATA_TIME) FROM T_MEMBERS WHERE 1=1'
+        params = []
+        if group_id:
+            sql += ' AND GROUP_ID = ?'
+            params.append(group_id)
+        result = self.read(sql, params)
         data_time = 0
-        if result:
+        if result and result[0][0]:
             data_time = int(datetime.strptime(result[0][0], '%Y-%m-%d %H:%M:%S').timestamp())
         return data_time
 
-    def deleteTempMemberTable(self, group_id: str = '') -> None:
+    def deleteTempMemberTable(self, group_id: str = '') -> bool:
         '''清除成员临时表数据'''
         sql = 'DELETE FROM T_MEMBERS WHERE 1=1'
         params = []
         if group_id:
             sql += ' AND GROUP_ID = ?'
             params.append(group_id)
-        conn = self.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(sql, params)
-        conn.commit()
+        with self.snapshot_lock:
+            if group_id:
+                self.member_hash.pop(int(group_id), None)
+                self.temp_data_time.pop(int(group_id), None)
+            else:
+                self.member_hash.clear()
+                self.temp_data_time.clear()
+            return self.write(sql, params)
+
+    def queryFilterCache(self, user_id: int) -> dict:
+        '''查询用户的筛选缓存，返回{缓存项: (内容, 获取时间戳)}，是否过期由调用方判断'''
+        result = self.read('SELECT FIELD, VALUE, DATA_TIME FROM FILTER_CACHE WHERE USER_ID = ?', [user_id])
+        return {field: (json.loads(value), data_time) for field, value, data_time in result}
+
+    def saveFilterCache(self, user_id: int, cache: dict) -> bool:
+        '''保存用户的筛选缓存，cache为{缓存项: 内容}，已存在的缓存项会被覆盖'''
+        now = time.time()
+        sql = 'INSERT OR REPLACE INTO FILTER_CACHE (USER_ID, FIELD, VALUE, DATA_TIME) VALUES (?, ?, ?, ?)'
+        return self.writeMany([(sql, [
+            (user_id, field, json.dumps(value, ensure_ascii=False), now)
+            for field, value in cache.items()
+        ])])
+
+    def deleteFilterCache(self, max_age: float) -> bool:
+        '''清除超过max_age秒的筛选缓存'''
+        return self.write('DELETE FROM FILTER_CACHE WHERE DATA_TIME < ?', [time.time() - max_age])
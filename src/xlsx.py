@@ -1,6 +1,7 @@
 import os
 import logging
 from openpyxl import Workbook, load_workbook, styles
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 
 from src.config import Config
@@ -48,6 +49,45 @@ class Xlsx:
                         cell.fill = styles.PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
         return True
 
+    def writeStream(self, sheet_name: str, rows, file_path: str = '', progress: callable = None) -> int:
+        '''以只写模式逐行写入表格并保存，首行为表头，rows可为生成器，内存占用与行数无关，返回写入的数据行数
+
+        progress(count)每写入1000行调用一次，用于汇报进度
+        '''
+        file_path = file_path or self.file_path
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(sheet_name)
+        rows = iter(rows)
+        header = next(rows, None)
+        if not header:
+            logging.warning('数据为空，未写入')
+            return 0
+        # 只写模式下列宽与冻结窗格需在写入数据前设置
+        for col in range(1, len(header) + 1):
+            ws.column_dimensions[get_column_letter(col)].width = 15
+        ws.freeze_panes = 'A2'
+        cheat_col = header.index('是否作弊') if '是否作弊' in header else -1
+        cheat_fill = styles.PatternFill(start_color='FF0000', end_color='FF0000', fill_type='solid')
+        ws.append(header)
+        count = 0
+        for row in rows:
+            row = list(row)
+            if cheat_col >= 0 and row[cheat_col] == '是':
+                cell = WriteOnlyCell(ws, value=row[cheat_col])
+                cell.fill = cheat_fill
+                row[cheat_col] = cell
+            ws.append(row)
+            count += 1
+            if progress and count % 1000 == 0:
+                progress(count)
+        ws.auto_filter.ref = f'A1:{get_column_letter(len(header))}{count + 1}'
+        try:
+            wb.save(file_path)
+        except PermissionError as e:
+            logging.error(f'文件保存失败!请勿在打开表格时操作：{e}')
+            raise e
+        return count
+
     def save(self) -> bool:
         '''保存表格数据到本地'''     
         try: